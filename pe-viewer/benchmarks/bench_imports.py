@@ -0,0 +1,87 @@
+"""
+Import time of the app's modules, each measured in a fresh interpreter
+with python -X importtime, and which of the heavy libraries each one
+loads.  The first row is everything streamlit-app.py imports before the
+sidebar and About section are drawn.  Run from the pe-viewer directory:
+
+    python benchmarks/bench_imports.py [--repeat 3] [--top 15]
+"""
+import argparse, ast, os, statistics, subprocess, sys
+
+APPDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ['peutils', 'eventrecord', 'samplestore', 'cachemanager', 'httpclient', 'download',
+           'metrics', 'render', 'figurecache', 'ingest', 'summarytable', 'histcube',
+           'skymapstore', 'straincache', 'whitening', 'kde', 'export',
+           'makepopulation', 'makealtair', 'makeskymap', 'makewaveform']
+
+# -- Libraries which should only be loaded by the sections which use them
+HEAVY = ['pesummary', 'gwpy', 'ligo', 'lalsimulation', 'astropy', 'altair', 'pandas',
+         'scipy', 'matplotlib', 'healpy', 'h5py', 'requests_pelican', 'gwosc']
+
+
+def startup_modules(script=os.path.join(APPDIR, 'streamlit-app.py')):
+    # -- Modules the app imports at the top level, i.e. before any section runs
+    with open(script) as filein:
+        tree = ast.parse(filein.read())
+    names = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            names.append(node.module)
+    return list(dict.fromkeys(names))
+
+
+def importtime(modules):
+    """
+    Import modules in a new interpreter; returns the total time in seconds
+    and a dictionary of the cumulative time of every package imported
+    """
+    code = 'import ' + ', '.join(modules)
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=APPDIR,
+                          env=dict(os.environ, MPLBACKEND='agg'),
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    cumulative = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        fields = line.split('|')
+        cumulative[fields[2].strip()] = int(fields[1]) / 1e6
+    total = sum(cumulative.get(module, 0) for module in modules)
+    return total, cumulative
+
+
+def measure(modules, repeat):
+    runs = [importtime(modules) for i in range(repeat)]
+    total = statistics.median(run[0] for run in runs)
+    loaded = [lib for lib in HEAVY if lib in runs[0][1]]
+    return total, loaded, runs[0][1]
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=3, help='runs per module; the median is shown')
+    parser.add_argument('--top', type=int, default=15,
+                        help='number of the slowest imports at startup to list')
+    args = parser.parse_args(args)
+
+    startup = startup_modules()
+    print('{0:<16} {1:>9}  {2}'.format('module', 'seconds', 'heavy libraries loaded'))
+    total, loaded, cumulative = measure(startup, args.repeat)
+    print('{0:<16} {1:>9.3f}  {2}'.format('(startup)', total, ', '.join(loaded) or '-'))
+    startup_times = cumulative
+    for module in MODULES:
+        total, loaded, cumulative = measure([module], args.repeat)
+        print('{0:<16} {1:>9.3f}  {2}'.format(module, total, ', '.join(loaded) or '-'))
+
+    print('\nSlowest top-level packages imported at startup ({0}):'.format(', '.join(startup)))
+    packages = {name: t for name, t in startup_times.items() if '.' not in name}
+    for name, t in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print('  {0:<30} {1:>7.3f}'.format(name, t))
+
+
+if __name__ == '__main__':
+    main()
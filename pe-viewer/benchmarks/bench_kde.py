@@ -0,0 +1,66 @@
+"""
+Compare the binned KDEs in kde.py with the pesummary KDEs they replace,
+on synthetic posterior samples.  Run from the pe-viewer directory:
+
+    python benchmarks/bench_kde.py
+"""
+import os, sys, time, types
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import kde
+from pesummary.utils.bounded_1d_kde import bounded_1d_kde
+from pesummary.utils.bounded_2d_kde import Bounded_2d_kde
+
+
+def timed(func, repeat=3):
+    best = np.inf
+    for i in range(repeat):
+        kde.clear_grids()
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def samples(n, rng):
+    mass_1 = rng.normal(30, 3, n)
+    mass_2 = mass_1 * rng.uniform(0.4, 1, n)
+    spin = np.abs(rng.normal(0, 0.3, n)) % 1
+    chi_p = rng.beta(2, 5, n)
+    return mass_1, mass_2, spin, chi_p
+
+
+def main():
+    rng = np.random.default_rng(1234)
+    # -- Warm up imports and caches on both sides
+    bounded_1d_kde(rng.beta(2, 5, 100), method='Transform', xlow=0, xhigh=1)(np.linspace(0, 1, 10))
+    print('{0:>7} {1:<22} {2:>10} {3:>10} {4:>8} {5:>10}'.format(
+        'samples', 'kde', 'pesummary', 'binned', 'speedup', 'max error'))
+    for n in [2000, 20000]:
+        mass_1, mass_2, spin, chi_p = samples(n, rng)
+        grid = np.linspace(0, 1, 100)
+        X, Y = np.meshgrid(np.linspace(mass_1.min(), mass_1.max(), 51),
+                           np.linspace(mass_2.min(), mass_2.max(), 51))
+        pts = np.vstack([X.ravel(), Y.ravel()])
+
+        cases = [
+            ('1-D reflection', lambda module: module.bounded_1d_kde(
+                spin, method='Reflection', xlow=0, xhigh=1)(grid)),
+            ('1-D transform', lambda module: module.bounded_1d_kde(
+                chi_p, method='Transform', xlow=0, xhigh=1)(grid)),
+            ('2-D reflection', lambda module: module.Bounded_2d_kde(
+                np.vstack([mass_1, mass_2]), xlow=0, ylow=0)(pts)),
+        ]
+        reference = types.SimpleNamespace(bounded_1d_kde=bounded_1d_kde,
+                                          Bounded_2d_kde=Bounded_2d_kde)
+        for name, func in cases:
+            slow, expected = timed(lambda: func(reference), repeat=1)
+            fast, result = timed(lambda: func(kde))
+            error = np.max(np.abs(result - expected)) / np.max(expected)
+            print('{0:>7} {1:<22} {2:>9.4f}s {3:>9.4f}s {4:>7.0f}x {5:>10.1e}'.format(
+                n, name, slow, fast, slow / fast, error))
+
+
+if __name__ == '__main__':
+    main()
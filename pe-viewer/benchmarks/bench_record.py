@@ -0,0 +1,68 @@
+"""
+Compare the pesummary read result that load_samples_pelican used to cache
+with the EventRecord projected from it: pickle size, pickle and unpickle
+time, and memory held by one unpickled copy.  A synthetic release file
+(four analyses with PSDs, calibration envelopes, configs and skymaps) is
+written first.  Run from the pe-viewer directory:
+
+    python benchmarks/bench_record.py [--samples 8000] [--nside 256]
+"""
+import argparse, os, pickle, sys, tempfile, time, tracemalloc
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import eventrecord
+from synthetic import write_release_file
+
+def measure(obj, repeat=3):
+    dump = load = np.inf
+    for i in range(repeat):
+        start = time.perf_counter()
+        data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+        dump = min(dump, time.perf_counter() - start)
+        start = time.perf_counter()
+        pickle.loads(data)
+        load = min(load, time.perf_counter() - start)
+
+    # -- Memory held by one unpickled copy
+    tracemalloc.start()
+    copy = pickle.loads(data)
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del copy
+    return len(data), dump, load, held
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--samples', type=int, default=8000, help='samples per analysis in the file')
+    parser.add_argument('--nside', type=int, default=256, help='HEALPix nside of the skymaps')
+    args = parser.parse_args(args)
+
+    from pesummary.io import read
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'release.h5')
+        write_release_file(path, n=args.samples, nside=args.nside)
+        print('release file: {0:.1f} MB'.format(os.path.getsize(path) / 1e6))
+
+        start = time.perf_counter()
+        samples = read(path, disable_prior=True)
+        samples.downsample(2000)
+        parse = time.perf_counter() - start
+
+    start = time.perf_counter()
+    record = eventrecord.project('GWTEST', samples, 'C01:IMRPhenomXPHM')
+    projection = time.perf_counter() - start
+    print('read + downsample: {0:.3f}s, projection: {1:.3f}s'.format(parse, projection))
+    print('record: {0!r}'.format(record))
+
+    print('{0:<12} {1:>10} {2:>10} {3:>10} {4:>10}'.format(
+        '', 'pickle', 'dump', 'load', 'memory'))
+    for name, obj in [('pesummary', samples), ('EventRecord', record)]:
+        size, dump, load, held = measure(obj)
+        print('{0:<12} {1:>8.1f}MB {2:>9.4f}s {3:>9.4f}s {4:>8.1f}MB'.format(
+            name, size / 1e6, dump, load, held / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Fixtures for the benchmark suite.  Everything runs offline: the release
+files and strain are synthetic (see synthetic.py), written under a
+temporary directory which every cache of the app is pointed at, and the
+catalog and download functions of peutils are replaced for each test.
+"""
+import os, sys, shutil, tempfile, tracemalloc
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# -- Events in the synthetic catalog, as chosen in the three sidebar boxes
+EVENTS = ['GW150914', 'GW151226', 'GW170104']
+
+# -- Samples per analysis in each release file, and skymap resolution;
+# -- smaller than the real files, so the suite runs in a few minutes
+NSAMPLES = 4000
+NSIDE = 64
+
+_tmpdir = None
+
+
+def pytest_configure(config):
+    """
+    Point every cache at a scratch directory.  The app's modules read their
+    directories when first imported, so this runs before any test imports them.
+    """
+    global _tmpdir
+    _tmpdir = tempfile.mkdtemp(prefix='peviewer-bench-')
+    for name, sub in [('DATADIR', 'data'), ('STOREDIR', 'samples'), ('RECORDDIR', 'records'),
+                      ('STRAINDIR', 'strain'), ('SKYMAPDIR', 'skymaps'), ('FIGDIR', 'figures'),
+                      ('HTTPDIR', 'http')]:
+        os.environ['PEVIEWER_' + name] = os.path.join(_tmpdir, sub)
+    os.environ['PEVIEWER_CACHE_DB'] = os.path.join(_tmpdir, 'cache.db')
+    os.environ['PEVIEWER_SUMMARY_TABLE'] = os.path.join(_tmpdir, 'summary-table.npz')
+    os.environ['PEVIEWER_MANIFEST'] = os.path.join(_tmpdir, 'manifest.json')
+    os.environ['PEVIEWER_GWOSC_URL'] = 'http://127.0.0.1:9'
+    os.environ.pop('PEVIEWER_CACHE', None)
+    sys.path.insert(0, os.path.dirname(HERE))
+    sys.path.insert(0, HERE)
+
+
+def pytest_unconfigure(config):
+    if _tmpdir is not None:
+        shutil.rmtree(_tmpdir, ignore_errors=True)
+
+
+@pytest.fixture(scope='session')
+def release_files():
+    # -- A synthetic release file for each event
+    import synthetic
+    files = {}
+    for i, event in enumerate(EVENTS):
+        path = os.path.join(_tmpdir, 'release', '{0}.h5'.format(event))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        files[event] = synthetic.write_release_file(path, n=NSAMPLES, nside=NSIDE, seed=i)
+    return files
+
+
+@pytest.fixture
+def offline(monkeypatch, release_files):
+    """
+    Catalog lookups and release file downloads answered from the synthetic
+    files, so load_samples_pelican runs without the network
+    """
+    import peutils, synthetic
+    catalog = {event: ('https://zenodo.org/records/0/files/{0}.h5'.format(event),
+                       'C01:IMRPhenomXPHM', 'GWTC-3-confident') for event in EVENTS}
+    monkeypatch.setattr(peutils, 'get_pe_url', lambda event: catalog[event])
+    monkeypatch.setattr(peutils, 'get_event_gps', lambda event: synthetic.GPS)
+    monkeypatch.setattr(peutils, 'get_event_detectors', lambda event: list(synthetic.IFOS))
+    monkeypatch.setattr(peutils, 'fetch_samples_file',
+                        lambda event, progress=None: release_files[event])
+    return release_files
+
+
+@pytest.fixture
+def datadict(offline):
+    # -- Shared EventRecords for every event, loaded once and stored on disk
+    import peutils
+    return peutils.get_datadict(EVENTS)
+
+
+@pytest.fixture
+def strain(offline):
+    # -- Gaussian strain for each event, in the strain cache
+    import synthetic
+    for i, event in enumerate(EVENTS):
+        synthetic.write_strain(event, seed=i)
+    return synthetic.IFOS
+
+
+def _peak(func, args, kwargs, setup):
+    # -- Peak memory traced while running func once, in MB
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return peak / 1e6
+
+
+@pytest.fixture
+def measure(benchmark):
+    """
+    Time func with pytest-benchmark, and record its peak traced memory as
+    extra_info['peak_mb'], failing if it is over budget_mb.  setup, if given,
+    runs untimed before every round, e.g. to empty a cache for a cold start;
+    with setup or rounds, func runs once per round, for slow functions.  The
+    memory is measured in a separate run, since tracing slows func down.
+    """
+    def run(func, *args, setup=None, rounds=None, budget_mb=None, **kwargs):
+        peak = _peak(func, args, kwargs, setup)
+        benchmark.extra_info['peak_mb'] = round(peak, 2)
+        if setup is None and rounds is None:
+            result = benchmark(func, *args, **kwargs)
+        else:
+            result = benchmark.pedantic(func, args=args, kwargs=kwargs, setup=setup,
+                                        rounds=rounds or 5, iterations=1)
+        if budget_mb is not None:
+            assert peak <= budget_mb, 'peak memory {0:.1f} MB is over the {1} MB budget'.format(
+                peak, budget_mb)
+        return result
+    return run
@@ -0,0 +1,95 @@
+"""
+Synthetic inputs for the benchmarks: pesummary-format release files shaped
+like the GWTC-2.1/3 data releases, and Gaussian strain written straight
+into the strain cache, so nothing is downloaded.
+"""
+import os
+import numpy as np
+
+IFOS = ['H1', 'L1', 'V1']
+
+# -- Analyses in each file, with their approximants; as in the data releases,
+# -- one has no approximant and one is not offered for waveforms
+LABELS = {'C01:IMRPhenomXPHM': 'IMRPhenomXPHM', 'C01:SEOBNRv4PHM': 'SEOBNRv4PHM',
+          'C01:Mixed': None, 'C01:IMRPhenomXPHM:HighSpin': 'IMRPhenomXPHM'}
+
+GPS = 1126259462.4
+
+
+def posterior(n, rng, gps=GPS, nextra=40):
+    """
+    Samples of a binary black hole posterior, with the parameters the app
+    plots and the ones pesummary needs to make a waveform
+    """
+    mass_1 = rng.normal(35, 3, n)
+    mass_2 = mass_1 * rng.uniform(0.5, 1, n)
+    a_1, a_2 = rng.uniform(0, 0.9, n), rng.uniform(0, 0.9, n)
+    tilt_1, tilt_2 = np.arccos(rng.uniform(-1, 1, n)), np.arccos(rng.uniform(-1, 1, n))
+    distance = rng.uniform(300, 600, n)
+    redshift = distance / 4400.
+    chirp_mass = (mass_1 * mass_2)**0.6 / (mass_1 + mass_2)**0.2
+    samples = {'mass_1': mass_1, 'mass_2': mass_2, 'mass_ratio': mass_2 / mass_1,
+               'total_mass': mass_1 + mass_2, 'chirp_mass': chirp_mass,
+               'mass_1_source': mass_1 / (1 + redshift), 'mass_2_source': mass_2 / (1 + redshift),
+               'chirp_mass_source': chirp_mass / (1 + redshift),
+               'total_mass_source': (mass_1 + mass_2) / (1 + redshift),
+               'a_1': a_1, 'a_2': a_2, 'tilt_1': tilt_1, 'tilt_2': tilt_2,
+               'cos_tilt_1': np.cos(tilt_1), 'cos_tilt_2': np.cos(tilt_2),
+               'phi_12': rng.uniform(0, 2*np.pi, n), 'phi_jl': rng.uniform(0, 2*np.pi, n),
+               'chi_eff': (mass_1 * a_1 * np.cos(tilt_1) + mass_2 * a_2 * np.cos(tilt_2))
+                          / (mass_1 + mass_2),
+               'chi_p': rng.beta(2, 5, n),
+               'luminosity_distance': distance, 'redshift': redshift,
+               'theta_jn': np.arccos(rng.uniform(-1, 1, n)), 'psi': rng.uniform(0, np.pi, n),
+               'phase': rng.uniform(0, 2*np.pi, n), 'ra': rng.uniform(0, 2*np.pi, n),
+               'dec': np.arcsin(rng.uniform(-1, 1, n)),
+               'geocent_time': gps + rng.normal(0, 0.01, n),
+               'log_likelihood': rng.normal(0, 1, n)}
+    # -- Release files carry many more derived parameters
+    for i in range(nextra):
+        samples['extra_{0}'.format(i)] = rng.normal(size=n)
+    return samples
+
+
+def psd(freq):
+    # -- Rough aLIGO-like noise curve
+    return 1e-46 * (1 + (50 / freq)**8 + (freq / 300)**2)
+
+
+def write_release_file(path, n=8000, nside=256, seed=1234, gps=GPS):
+    # -- A pesummary-format file shaped like a GWTC-2.1/3 release file
+    from pesummary.core.file.formats.pesummary import write_pesummary
+    from pesummary.gw.file.meta_file import _GWMetaFile
+    from pesummary.gw.file.skymap import SkyMap
+    from pesummary.utils.samples_dict import MultiAnalysisSamplesDict
+
+    rng = np.random.default_rng(seed)
+    labels = list(LABELS)
+    freq = np.arange(20, 2048, 1 / 8.)
+    psds = np.column_stack([freq, psd(freq)]).tolist()
+    cal = np.column_stack([freq[:1000]] + [np.ones(1000)] * 6).tolist()
+    skymaps = {}
+    for label in labels:
+        prob = rng.random(12 * nside**2)
+        skymaps[label] = SkyMap(prob / prob.sum(), {'nside': nside, 'nest': True})
+
+    samples = {label: posterior(n, rng, gps) for label in labels}
+    write_pesummary(MultiAnalysisSamplesDict(samples),
+                    cls=_GWMetaFile, outdir=os.path.dirname(path),
+                    filename=os.path.basename(path),
+                    config=[{'engine': {'fref': '20'}} for label in labels],
+                    psd={label: {ifo: psds for ifo in IFOS} for label in labels},
+                    calibration={label: {ifo: cal for ifo in IFOS} for label in labels},
+                    approximant=LABELS, skymap=skymaps, hdf5=True)
+    return path
+
+
+def write_strain(event, t0=GPS, ifos=IFOS, span=28, sample_rate=4096, seed=1234):
+    # -- Gaussian noise for each detector, stored where straincache.fetch_strain looks
+    from gwpy.timeseries import TimeSeries
+    import straincache
+    rng = np.random.default_rng(seed)
+    for ifo in ifos:
+        series = TimeSeries(rng.normal(0, 1e-21, span * sample_rate), t0=t0 - span / 2,
+                            dt=1. / sample_rate, name=ifo)
+        straincache.save_series(straincache.strain_key(event, ifo, span, sample_rate), series)
@@ -0,0 +1,187 @@
+"""
+Benchmarks of the paths users wait on: loading an event, assembling the
+samples for the plots, the 1-D histograms, the triangle plot KDEs, and
+whitening and projecting the waveform.  Run from the pe-viewer directory:
+
+    pip install -r benchmarks/requirements.txt
+    python -m pytest benchmarks --benchmark-autosave
+
+and compare a later run with the saved one, failing on a regression:
+
+    python -m pytest benchmarks --benchmark-compare --benchmark-compare-fail=mean:20%
+
+Peak traced memory of each benchmark is saved in its extra_info, and each
+has a memory budget it must stay within.
+"""
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from conftest import EVENTS
+
+
+def drop_event(event):
+    # -- Remove an event from the in-memory and on-disk caches
+    import peutils, eventrecord, samplestore
+    peutils.load_samples_pelican.clear()
+    peutils.get_published_samples.clear()
+    eventrecord._backend().drop_local(eventrecord.record_key(event))
+    samplestore._backend().drop_local(event)
+
+
+# --
+# Loading samples
+# --
+
+def test_load_samples_cold(measure, offline):
+    # -- Release file to EventRecord: parse, downsample, project, store
+    import peutils
+    record = measure(peutils.load_samples_pelican, EVENTS[0],
+                     setup=lambda: drop_event(EVENTS[0]), rounds=3, budget_mb=150)
+    assert record.published
+
+
+def test_load_samples_warm(measure, offline):
+    # -- A new process: the record is on disk, but not yet in memory
+    import peutils
+    peutils.load_samples_pelican(EVENTS[0])
+    record = measure(peutils.load_samples_pelican, EVENTS[0],
+                     setup=peutils.load_samples_pelican.clear, rounds=20, budget_mb=5)
+    assert record.published
+
+
+def test_format_data(measure, datadict):
+    # -- Published samples of the three chosen events, from the sample store
+    import peutils
+    published = measure(peutils.format_data, EVENTS, datadict,
+                        setup=peutils.get_published_samples.clear, rounds=20, budget_mb=5)
+    assert set(published) == set(EVENTS)
+
+
+def test_params_intersect(measure, datadict):
+    import peutils, makealtair
+    published = peutils.format_data(EVENTS, datadict)
+    params = measure(makealtair.get_params_intersect, published, EVENTS, budget_mb=1)
+    assert 'chirp_mass' in params
+
+
+# --
+# 1-D histograms
+# --
+
+def test_build_hist_cube(measure, datadict):
+    # -- Fine histograms and KDE curves of every parameter, made at ingest
+    import peutils, histcube
+    columns = peutils.format_data(EVENTS, datadict)[EVENTS[0]]
+    cube = measure(histcube.build_cube, columns, peutils.ALL_PARAM, budget_mb=10)
+    assert 'chirp_mass.counts' in cube
+
+
+def test_rebin_hist_cubes(measure, datadict):
+    # -- What make_altair_plots does for each parameter on every rerun
+    import peutils, histcube, makealtair
+    published = peutils.format_data(EVENTS, datadict)
+    cubes = [histcube.build_cube(published[event], peutils.ALL_PARAM) for event in EVENTS]
+    params = makealtair.get_params_intersect(published, EVENTS)
+
+    def rebin_all():
+        for param in params:
+            edges = histcube.shared_edges(cubes, param)
+            for cube in cubes:
+                histcube.rebin(cube, param, edges)
+
+    measure(rebin_all, budget_mb=1)
+
+
+# --
+# Triangle plot
+# --
+
+TRIANGLE_PARAMS = ['mass_1', 'mass_2']
+
+@pytest.fixture
+def triangle_columns(datadict):
+    import peutils, render
+    published = peutils.format_data(EVENTS, datadict)
+    return render.sample_columns(published, TRIANGLE_PARAMS)
+
+
+def test_triangle_kde(measure, triangle_columns):
+    # -- The bounded 1-D and 2-D KDEs of the triangle plot, on its grid
+    import numpy as np
+    import kde
+
+    def evaluate():
+        kwargs = kde.triangle_kwargs(TRIANGLE_PARAMS)
+        for columns in triangle_columns.values():
+            x, y = (columns[param] for param in TRIANGLE_PARAMS)
+            xgrid = np.linspace(x.min(), x.max(), 100)
+            ygrid = np.linspace(y.min(), y.max(), 100)
+            kde.bounded_1d_kde(x, **kwargs['kde_kwargs']['x_axis'])(xgrid)
+            kde.bounded_1d_kde(y, **kwargs['kde_kwargs']['y_axis'])(ygrid)
+            X, Y = np.meshgrid(xgrid, ygrid)
+            kde.Bounded_2d_kde(np.vstack([x, y]), **kwargs['kde_2d_kwargs'])(
+                np.vstack([X.ravel(), Y.ravel()]))
+
+    measure(evaluate, setup=kde.clear_grids, budget_mb=60)
+
+
+def test_triangle_plot(measure, triangle_columns):
+    # -- The whole figure, drawn to PNG in this process rather than the pool
+    import render
+    png = measure(render._render, render.triangle_plot, (triangle_columns, TRIANGLE_PARAMS), {},
+                  rounds=2, budget_mb=300)
+    assert png[:4] == b'\x89PNG'
+
+
+# --
+# Waveform
+# --
+
+@pytest.fixture
+def analysis(datadict):
+    # -- Record, label and samples of the first analysis offered for waveforms
+    record = datadict[EVENTS[0]]
+    label = list(record.analyses)[0]
+    return record, label, record.samples_dict(label)
+
+
+def test_project_waveform(measure, analysis):
+    # -- Maximum likelihood waveform projected onto each detector
+    pytest.importorskip('lalsimulation')
+    import synthetic
+    record, label, samples = analysis
+
+    def project():
+        return {ifo: samples.maxL_td_waveform(record.approximant[label], delta_t=1/4096.,
+                                              f_low=20, f_ref=float(record.fref[label]),
+                                              project=ifo)
+                for ifo in synthetic.IFOS}
+
+    templates = measure(project, rounds=3, budget_mb=20)
+    assert set(templates) == set(synthetic.IFOS)
+
+
+def test_whiten_event(measure, analysis, strain):
+    # -- Strain and templates for every detector whitened with the PE PSDs
+    pytest.importorskip('lalsimulation')
+    import straincache, synthetic
+    record, label, samples = analysis
+    ifos = tuple(strain)
+    psds = {ifo: record.psd[label][ifo] for ifo in ifos}
+    templates = {ifo: samples.maxL_td_waveform(record.approximant[label], delta_t=1/4096.,
+                                               f_low=20, f_ref=float(record.fref[label]),
+                                               project=ifo).taper().pad(3 * 4096)
+                 for ifo in ifos}
+
+    def drop_whitened():
+        # -- So every round whitens, rather than reading the stored result
+        for ifo in ifos:
+            key = straincache.whitened_key(EVENTS[0], ifo, 28, 4096, label)
+            straincache._drop(key)
+            assert straincache.load_series(key) is None
+
+    white_data, white_temps = measure(straincache.whiten_event, EVENTS[0], ifos, synthetic.GPS,
+                                      label, psds, templates, setup=drop_whitened, rounds=3,
+                                      budget_mb=60)
+    assert set(white_data) == set(white_temps) == set(ifos)
@@ -0,0 +1,256 @@
+"""
+Storage backends for the download, sample and strain caches.
+
+Every cache keeps a local working directory.  Entries are addressed by a
+relative key such as 'blobs/ab/abcd....h5' and are always read from the
+local copy.  The backend decides where the authoritative copy lives:
+
+ * FileBackend - the local directory itself.  Point it at a shared mount
+   (e.g. a PVC) and all replicas share one copy of each entry.
+ * S3Backend - an S3-compatible object store (AWS, MinIO, ...).  Entries
+   are pulled into the local directory on first use and pushed after
+   they are written.
+
+The backend is chosen with the PEVIEWER_CACHE environment variable:
+
+    PEVIEWER_CACHE=file:///mnt/peviewer        shared filesystem
+    PEVIEWER_CACHE=s3://bucket/prefix          object store
+    PEVIEWER_S3_ENDPOINT=http://minio:9000     optional, for MinIO
+
+If PEVIEWER_CACHE is not set, each cache uses its own local directory.
+"""
+import os, time, fcntl, hashlib, shutil, tempfile, threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+CACHE_URL = os.environ.get('PEVIEWER_CACHE', '')
+S3_ENDPOINT = os.environ.get('PEVIEWER_S3_ENDPOINT') or None
+
+# -- A remote fill lease older than this is assumed to be abandoned
+LEASE_TIMEOUT = 30 * 60
+
+
+def _atomic_copy(src, dest, move=False):
+    # -- Copy src into place at dest, or rename it if move is set
+    if os.path.abspath(src) == os.path.abspath(dest):
+        return dest
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    if move:
+        os.replace(src, dest)
+        return dest
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(dest), suffix='.part')
+    os.close(fd)
+    try:
+        shutil.copyfile(src, tmpname)
+        os.replace(tmpname, dest)
+    except:
+        os.remove(tmpname)
+        raise
+    return dest
+
+
+class FileBackend:
+    """
+    Entries are plain files under root, which may be a local directory
+    or, with shared=True, a filesystem shared between replicas.
+    """
+    def __init__(self, root, shared=False):
+        self.root = root
+        self.shared = shared
+        self._locks = {}
+        self._mutex = threading.Lock()
+
+    def local_path(self, key):
+        return os.path.join(self.root, key)
+
+    def get(self, key):
+        # -- Local path for key, or None if there is no such entry
+        path = self.local_path(key)
+        return path if os.path.exists(path) else None
+
+    def put(self, key, src, move=False):
+        # -- Store the file src as key; with move=True, src is renamed into place
+        return _atomic_copy(src, self.local_path(key), move=move)
+
+    def delete(self, key):
+        path = self.local_path(key)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def drop_local(self, key):
+        """
+        Free local disk used by key.  For a local FileBackend this is the
+        entry itself; a shared one has no local copy, and the entry is left
+        for the other replicas.
+        """
+        if not self.shared:
+            FileBackend.delete(self, key)
+
+    def list(self, prefix=''):
+        # -- Keys of every entry under prefix, skipping hidden temporary and lock files
+        top = self.local_path(prefix)
+        keys = []
+        for dirpath, dirnames, filenames in os.walk(top):
+            dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+            reldir = os.path.relpath(dirpath, self.root)
+            for fn in filenames:
+                if fn.startswith('.') or fn.endswith('.part'): continue
+                keys.append(fn if reldir == '.' else '/'.join([reldir.replace(os.sep, '/'), fn]))
+        return sorted(keys)
+
+    @contextmanager
+    def lock(self, key):
+        """
+        Hold an exclusive lock on key.  flock serializes other processes,
+        including other replicas on a shared mount; the thread lock
+        serializes threads in this process, since flock does not.
+        """
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        with self._mutex:
+            tlock = self._locks.setdefault(digest, threading.Lock())
+
+        lockdir = os.path.join(self.root, '.locks')
+        os.makedirs(lockdir, exist_ok=True)
+        with tlock, open(os.path.join(lockdir, digest + '.lock'), 'w') as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+
+class S3Backend(FileBackend):
+    """
+    Entries live in an S3-compatible bucket, mirrored into the local root.
+    """
+    # -- Remember misses for this long, to avoid a request on every lookup
+    MISS_TTL = 30
+
+    def __init__(self, root, bucket, prefix='', endpoint_url=None):
+        super().__init__(root)
+        try:
+            import boto3
+        except ImportError:
+            raise ImportError('The S3 cache backend requires boto3')
+        self.client = boto3.client('s3', endpoint_url=endpoint_url)
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self._misses = {}
+
+    def remote_key(self, key):
+        return '/'.join(filter(None, [self.prefix, key]))
+
+    def get(self, key):
+        path = super().get(key)
+        if path is not None:
+            return path
+        if time.time() - self._misses.get(key, 0) < self.MISS_TTL:
+            return None
+
+        from botocore.exceptions import ClientError
+        path = self.local_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+        os.close(fd)
+        try:
+            self.client.download_file(self.bucket, self.remote_key(key), tmpname)
+            os.replace(tmpname, path)
+        except ClientError:
+            os.remove(tmpname)
+            self._misses[key] = time.time()
+            return None
+        except:
+            os.remove(tmpname)
+            raise
+        return path
+
+    def put(self, key, src, move=False):
+        path = super().put(key, src, move=move)
+        self.client.upload_file(path, self.bucket, self.remote_key(key))
+        self._misses.pop(key, None)
+        return path
+
+    def delete(self, key):
+        super().delete(key)
+        self.client.delete_object(Bucket=self.bucket, Key=self.remote_key(key))
+
+    def list(self, prefix=''):
+        # -- Keys in the bucket, which holds every entry; the local root may hold only some
+        start = len(self.prefix) + 1 if self.prefix else 0
+        keys = []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.remote_key(prefix)):
+            for obj in page.get('Contents', []):
+                key = obj['Key'][start:]
+                if not key.startswith('.locks/'):
+                    keys.append(key)
+        return sorted(keys)
+
+    @contextmanager
+    def lock(self, key):
+        """
+        Lock locally, then take a lease object in the bucket.  The lease is
+        created with a conditional put, so only one replica can hold it.
+        """
+        from botocore.exceptions import ClientError
+        leasekey = self.remote_key('.locks/' + hashlib.sha1(key.encode()).hexdigest())
+
+        with super().lock(key):
+            while True:
+                try:
+                    self.client.put_object(Bucket=self.bucket, Key=leasekey,
+                                           Body=b'', IfNoneMatch='*')
+                    break
+                except ClientError as exc:
+                    code = exc.response.get('Error', {}).get('Code')
+                    if code not in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                        raise
+                # -- Someone else is filling this entry; break stale leases
+                try:
+                    head = self.client.head_object(Bucket=self.bucket, Key=leasekey)
+                    if time.time() - head['LastModified'].timestamp() > LEASE_TIMEOUT:
+                        self.client.delete_object(Bucket=self.bucket, Key=leasekey)
+                except ClientError:
+                    pass
+                time.sleep(2)
+
+            # -- Entries may have been filled while we waited
+            self._misses.clear()
+            try:
+                yield
+            finally:
+                self.client.delete_object(Bucket=self.bucket, Key=leasekey)
+
+
+def shared_filesystem():
+    # -- True if the caches live on a filesystem shared between replicas
+    return urlparse(CACHE_URL).scheme == 'file'
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+def get_backend(namespace, localroot):
+    """
+    Return the backend for one cache (e.g. 'data', 'samples', 'strain').
+    localroot is the cache's own local directory.
+    """
+    with _backends_lock:
+        if namespace in _backends:
+            return _backends[namespace]
+
+        url = urlparse(CACHE_URL)
+        if url.scheme == 'file':
+            backend = FileBackend(os.path.join(url.path, namespace), shared=True)
+        elif url.scheme == 's3':
+            prefix = '/'.join(filter(None, [url.path.strip('/'), namespace]))
+            backend = S3Backend(localroot, url.netloc, prefix, endpoint_url=S3_ENDPOINT)
+        elif url.scheme == '':
+            backend = FileBackend(localroot)
+        else:
+            raise ValueError('Unknown PEVIEWER_CACHE scheme: {0}'.format(CACHE_URL))
+
+        _backends[namespace] = backend
+        return backend
@@ -0,0 +1,214 @@
+"""
+Size accounting and eviction for the on-disk caches.
+
+Each cache registers a namespace (e.g. 'data' for downloaded release files,
+'samples' for the sample store) with a function that drops one entry.  The
+manager records the size, last access time and hit count of every entry in
+a small sqlite database, and evicts entries once the total size is over
+the byte budget.
+
+    PEVIEWER_CACHE_BYTES    byte budget (default 20 GB)
+    PEVIEWER_CACHE_POLICY   'lru' (default) or 'lfu'
+    PEVIEWER_CACHE_DB       path of the accounting database
+
+The budget applies to this replica's local disk.  When the caches are on a
+shared filesystem (PEVIEWER_CACHE=file://...) every entry is a copy other
+replicas depend on, so entries are not recorded or evicted here; only hits
+and misses are counted, and the size of the shared volume is left to
+whoever owns it.  With an object store, the local mirror is budgeted as
+usual and the bucket is left alone.
+"""
+import os, time, sqlite3, threading
+from contextlib import contextmanager
+
+import metrics
+from cachebackend import shared_filesystem
+
+CACHE_BYTES = int(float(os.environ.get('PEVIEWER_CACHE_BYTES', 20e9)))
+CACHE_POLICY = os.environ.get('PEVIEWER_CACHE_POLICY', 'lru').lower()
+CACHE_DB = os.environ.get('PEVIEWER_CACHE_DB',
+                          os.path.join(os.path.expanduser('~'), '.peviewer', 'cache.db'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    namespace TEXT, key TEXT, size INTEGER, created REAL,
+    last_access REAL, hits INTEGER, PRIMARY KEY (namespace, key));
+CREATE TABLE IF NOT EXISTS counters (
+    namespace TEXT PRIMARY KEY, hits INTEGER, misses INTEGER);
+"""
+
+
+def path_size(path):
+    # -- Size in bytes of a file, or of all files below a directory
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for fn in files:
+            try:
+                total += os.path.getsize(os.path.join(root, fn))
+            except OSError:
+                pass
+    return total
+
+
+def format_bytes(nbytes):
+    for unit in ['B', 'kB', 'MB', 'GB']:
+        if abs(nbytes) < 1000:
+            return '{0:.1f} {1}'.format(nbytes, unit)
+        nbytes /= 1000
+    return '{0:.1f} TB'.format(nbytes)
+
+
+# -- Functions which remove one entry of each namespace from disk
+_droppers = {}
+
+def register(namespace, drop):
+    """
+    Register a cache namespace; drop(key) removes one of its entries from disk
+    """
+    _droppers[namespace] = drop
+
+
+class CacheManager:
+    def __init__(self, dbpath=CACHE_DB, budget=CACHE_BYTES, policy=CACHE_POLICY, shared=None):
+        self.dbpath = dbpath
+        self.budget = budget
+        self.policy = policy
+        self.shared = shared_filesystem() if shared is None else shared
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(dbpath) or '.', exist_ok=True)
+        with self.connect() as db:
+            db.executescript(SCHEMA)
+
+    @contextmanager
+    def connect(self):
+        # -- Connection for one transaction, committed and closed on exit
+        db = sqlite3.connect(self.dbpath, timeout=30)
+        try:
+            db.execute('PRAGMA journal_mode=WAL')
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _count(self, db, namespace, column):
+        db.execute('INSERT OR IGNORE INTO counters VALUES (?, 0, 0)', (namespace,))
+        db.execute('UPDATE counters SET {0} = {0} + 1 WHERE namespace = ?'.format(column),
+                   (namespace,))
+
+    def hit(self, namespace, key, path=None):
+        """
+        Record a cache hit.  Entries not yet known to the manager (for example,
+        filled by another replica) are added, sized from path.
+        """
+        now = time.time()
+        metrics.inc('peviewer_cache_hits_total', namespace=namespace)
+        with self.connect() as db:
+            self._count(db, namespace, 'hits')
+            cur = db.execute('UPDATE entries SET last_access = ?, hits = hits + 1 '
+                             'WHERE namespace = ? AND key = ?', (now, namespace, key))
+            known = cur.rowcount > 0
+        if not known and path is not None:
+            self.add(namespace, key, path_size(path), hits=1)
+
+    def miss(self, namespace, key=None):
+        metrics.inc('peviewer_cache_misses_total', namespace=namespace)
+        with self.connect() as db:
+            self._count(db, namespace, 'misses')
+
+    def add(self, namespace, key, size, hits=0):
+        # -- Record a new entry, then evict others if over budget
+        if self.shared:
+            return
+        now = time.time()
+        with self.connect() as db:
+            db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+                       (namespace, key, size, now, now, hits))
+        self.evict(keep=[(namespace, key)])
+
+    def remove(self, namespace, key):
+        with self.connect() as db:
+            db.execute('DELETE FROM entries WHERE namespace = ? AND key = ?', (namespace, key))
+
+    def total_bytes(self, namespace=None):
+        with self.connect() as db:
+            if namespace is None:
+                row = db.execute('SELECT SUM(size) FROM entries').fetchone()
+            else:
+                row = db.execute('SELECT SUM(size) FROM entries WHERE namespace = ?',
+                                 (namespace,)).fetchone()
+        return row[0] or 0
+
+    def namespace_bytes(self):
+        with self.connect() as db:
+            rows = db.execute('SELECT namespace, SUM(size) FROM entries GROUP BY namespace').fetchall()
+        return {namespace: size or 0 for namespace, size in rows}
+
+    def evict(self, budget=None, keep=()):
+        """
+        Drop entries, least recently (or least frequently) used first,
+        until the total size is within budget.  Returns the evicted keys.
+        """
+        budget = self.budget if budget is None else budget
+        order = 'hits, last_access' if self.policy == 'lfu' else 'last_access'
+        evicted = []
+        with self.lock:
+            total = self.total_bytes()
+            if total <= budget:
+                return evicted
+            with self.connect() as db:
+                rows = db.execute('SELECT namespace, key, size FROM entries '
+                                  'ORDER BY ' + order).fetchall()
+            for namespace, key, size in rows:
+                if total <= budget: break
+                if (namespace, key) in keep: continue
+                if namespace not in _droppers: continue
+                try:
+                    _droppers[namespace](key)
+                except OSError:
+                    continue
+                self.remove(namespace, key)
+                total -= size
+                evicted.append((namespace, key))
+        return evicted
+
+    def clear(self):
+        return self.evict(budget=0)
+
+    def entries(self, namespace=None):
+        query = 'SELECT namespace, key, size, created, last_access, hits FROM entries'
+        args = ()
+        if namespace is not None:
+            query += ' WHERE namespace = ?'
+            args = (namespace,)
+        with self.connect() as db:
+            rows = db.execute(query + ' ORDER BY last_access DESC', args).fetchall()
+        names = ['namespace', 'key', 'size', 'created', 'last_access', 'hits']
+        return [dict(zip(names, row)) for row in rows]
+
+    def stats(self):
+        with self.connect() as db:
+            rows = db.execute('SELECT namespace, hits, misses FROM counters').fetchall()
+            nentries = db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        hits = sum(row[1] for row in rows)
+        misses = sum(row[2] for row in rows)
+        lookups = hits + misses
+        return {'bytes': self.total_bytes(),
+                'budget': self.budget,
+                'entries': nentries,
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'namespaces': {row[0]: {'hits': row[1], 'misses': row[2]} for row in rows}}
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+def get_manager():
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = CacheManager()
+        return _manager
@@ -0,0 +1,138 @@
+import os, json, hashlib, tempfile
+from urllib.parse import urlparse
+
+from cachebackend import FileBackend, get_backend
+from cachemanager import get_manager, register
+import httpclient
+import metrics
+
+# -- Downloaded files are kept here, named by the sha256 of their contents
+DATADIR = os.environ.get('PEVIEWER_DATADIR',
+                         os.path.join(os.path.expanduser('~'), '.peviewer', 'data'))
+
+# -- Peak memory per download is bounded by this many bytes
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+class DownloadError(Exception):
+    pass
+
+
+def _backend(datadir=None):
+    if datadir is not None:
+        return FileBackend(datadir)
+    return get_backend('data', DATADIR)
+
+
+# -- Let the cache manager evict entries to stay within its byte budget
+register('data', lambda key: _backend().drop_local(key))
+
+
+def _url_key(url):
+    # -- Small JSON file recording which blob a URL resolved to
+    return 'urls/' + hashlib.sha1(url.encode()).hexdigest() + '.json'
+
+
+def _blob_key(sha256, suffix=''):
+    return 'blobs/{0}/{1}{2}'.format(sha256[:2], sha256, suffix)
+
+
+def cached_path(url, datadir=None):
+    """
+    Return the local file for a previously downloaded URL, or None
+    """
+    backend = _backend(datadir)
+    try:
+        with open(backend.get(_url_key(url))) as filein:
+            record = json.load(filein)
+    except (TypeError, OSError, ValueError):
+        return None
+
+    path = backend.get(record['key'])
+    if path is not None and os.path.getsize(path) == record['size']:
+        return path
+    return None
+
+
+def stream_download(url, getter=httpclient.get, suffix='', checksum=None,
+                    progress=None, datadir=None, chunk_size=CHUNK_SIZE):
+    """
+    Download url in chunks to a content-addressed file in the data cache.
+
+    getter is any requests-style get function (e.g. requests_pelican.get).
+    checksum is an optional 'algorithm:hexdigest' string, e.g. 'md5:...';
+    without one, only the length reported by the server is checked.
+    progress is called as progress(bytes_done, bytes_total) after each chunk;
+    bytes_total is None when the server does not report a length.
+    """
+    path = cached_path(url, datadir)
+    # -- Account only for the shared data cache, not for explicit directories
+    manager = get_manager() if datadir is None else None
+    if path is not None:
+        if manager:
+            manager.hit('data', os.path.relpath(path, _backend().root), path)
+        return path
+    if manager:
+        manager.miss('data')
+
+    # -- Only one process (or replica, for a shared backend) fills each URL
+    backend = _backend(datadir)
+    with backend.lock(_url_key(url)):
+        path = cached_path(url, datadir)
+        if path is not None:
+            return path
+        return _fill(backend, url, getter, suffix, checksum, progress, chunk_size, manager)
+
+
+def _fill(backend, url, getter, suffix, checksum, progress, chunk_size, manager=None):
+    if checksum is not None:
+        algorithm, expected = checksum.split(':', 1)
+        checkhash = hashlib.new(algorithm)
+    sha256 = hashlib.sha256()
+
+    tmpdir = backend.local_path('blobs')
+    os.makedirs(tmpdir, exist_ok=True)
+    fd, tmpname = tempfile.mkstemp(dir=tmpdir, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as fileout, getter(url, stream=True) as r:
+            r.raise_for_status()
+            # -- Content-Length counts encoded bytes, so only trust it for identity encoding
+            total = r.headers.get('Content-Length')
+            if r.headers.get('Content-Encoding', 'identity') != 'identity':
+                total = None
+            total = int(total) if total else None
+
+            done = 0
+            host = urlparse(url).netloc
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                if not chunk: continue
+                metrics.inc('peviewer_download_bytes_total', len(chunk), host=host)
+                fileout.write(chunk)
+                sha256.update(chunk)
+                if checksum is not None:
+                    checkhash.update(chunk)
+                done += len(chunk)
+                if progress is not None:
+                    progress(done, total)
+
+        # -- Verify the download before making it visible
+        if total is not None and done != total:
+            raise DownloadError('{0}: expected {1} bytes, got {2}'.format(url, total, done))
+        if checksum is not None and checkhash.hexdigest() != expected.lower():
+            raise DownloadError('{0}: {1} checksum mismatch'.format(url, algorithm))
+
+        blobkey = _blob_key(sha256.hexdigest(), suffix)
+        path = backend.put(blobkey, tmpname, move=True)
+        if manager:
+            manager.add('data', blobkey, done)
+    except:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+        raise
+
+    # -- Record the URL only once its blob is in place
+    fd, tmpname = tempfile.mkstemp(dir=tmpdir, suffix='.json')
+    with os.fdopen(fd, 'w') as fileout:
+        json.dump({'url': url, 'key': blobkey, 'size': done}, fileout)
+    backend.put(_url_key(url), tmpname, move=True)
+    return path
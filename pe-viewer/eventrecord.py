@@ -0,0 +1,264 @@
+"""
+The parts of a PE release file that the app uses, for one event.
+
+pesummary's read result carries every analysis in the file, with its
+PSDs, calibration envelopes, priors and config.  The app only needs the
+published samples, plus the approximant, reference frequency and PSDs of
+the analyses offered on the Waveform page and the skymaps offered on the
+Skymaps page.  EventRecord holds exactly those, as plain numpy arrays, so
+it is quick to pickle and small in memory.
+
+Records are stored on disk with their arrays out of band (pickle protocol
+5), and loaded by memory mapping the file, so the arrays are read-only
+views of the page cache: every process on a node that loads the same
+event shares one copy.
+"""
+import os, mmap, pickle, re, struct, tempfile
+import numpy as np
+
+from cachebackend import get_backend
+from cachemanager import get_manager, register
+
+# -- Records are pickled here, one file per event
+RECORDDIR = os.environ.get('PEVIEWER_RECORDDIR',
+                           os.path.join(os.path.expanduser('~'), '.peviewer', 'records'))
+
+# -- Bump when the fields of EventRecord or the file layout change
+RECORD_VERSION = 3
+
+# -- Array buffers in a record file start on multiples of this many bytes
+ALIGN = 64
+
+# -- Analyses with these approximants are not offered for waveforms
+# -- (no GPS information in the release files)
+SKIP_APPROXIMANTS = ['SEOBNRv4PHM']
+
+
+def _backend():
+    return get_backend('records', RECORDDIR)
+
+
+# -- Let the cache manager evict entries to stay within its byte budget
+register('records', lambda key: _backend().drop_local(key))
+
+
+def _safe(name):
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', str(name))
+
+
+def record_key(event):
+    return '{0}.v{1}.pkl'.format(_safe(event), RECORD_VERSION)
+
+
+def _columns(samples):
+    # -- A SamplesDict as a plain dictionary of float arrays.  Keys are plain
+    # -- str, not pesummary's Parameter, so loading a record does not import pesummary
+    return {str(param): np.asarray(samples[param], dtype=np.float64) for param in samples.keys()}
+
+
+class EventRecord:
+    """
+    Projection of a pesummary read result onto what the app uses.
+    Samples are kept as dictionaries of parameter -> array; use
+    samples_dict() for a pesummary SamplesDict.
+    """
+    __slots__ = ('event', 'label', 'published', 'analyses', 'approximant',
+                 'fref', 'psd', 'skymap')
+
+    def __init__(self, event, label, published, analyses=None, approximant=None,
+                 fref=None, psd=None, skymap=None):
+        self.event = event
+        self.label = label
+        self.published = published
+        self.analyses = analyses or {}
+        self.approximant = approximant or {}
+        self.fref = fref or {}
+        self.psd = psd or {}
+        self.skymap = skymap or {}
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        for name in self.__slots__:
+            setattr(self, name, state[name])
+
+    def __repr__(self):
+        return 'EventRecord({0!r}, label={1!r}, analyses={2})'.format(
+            self.event, self.label, list(self.analyses))
+
+    def arrays(self):
+        # -- Every array held by the record
+        yield from self.published.values()
+        for columns in self.analyses.values():
+            yield from columns.values()
+        for psds in self.psd.values():
+            yield from psds.values()
+        yield from self.skymap.values()
+
+    def freeze(self):
+        # -- Make the arrays read-only, for records shared between sessions
+        for array in self.arrays():
+            array.flags.writeable = False
+        return self
+
+    def samples_dict(self, label=None):
+        # -- SamplesDict for one analysis, or for the published samples
+        from pesummary.utils.samples_dict import SamplesDict
+        columns = self.published if label is None else self.analyses[label]
+        return SamplesDict(dict(columns))
+
+
+# -- Select the published analysis from a pesummary object
+def select_preferred(samples, waveform):
+    #-- The first key should be the preferred samples for GWTC-2.1 and GWTC-3,
+    #-- and the second is a KLUDGE for GWTC-4.0
+    for label in [waveform, 'C00:'+waveform]:
+        try:
+            return label, samples.samples_dict[label]
+        except:
+            pass
+
+    #-- GWTC-1
+    return None, samples.samples_dict
+
+
+def get_fref(samples, label):
+    # -- Reference frequency of one analysis, or None if the config lacks it
+    try:
+        return float(samples.config[label]['engine']['fref'])
+    except:
+        pass
+    try:
+        return float(samples.config[label]['config']['reference-frequency'])
+    except:
+        return None
+
+
+def read_release_file(event, fn, nsamples=2000):
+    # -- Read and downsample a PE release file with pesummary
+    from pesummary.io import read
+    if event == 'GW170817':
+        #-- GWTC-1 file, with the low-spin analysis as the published samples
+        samples = read(fn, path_to_samples="IMRPhenomPv2NRT_lowSpin_posterior", disable_prior=True)
+    else:
+        samples = read(fn, disable_prior=True)
+
+    try:
+        samples.downsample(nsamples)
+    except:
+        pass
+    return samples
+
+
+def project(event, samples, waveform):
+    """
+    Build an EventRecord from a pesummary read result.  Only analyses with
+    a usable approximant are kept (the first analysis for each, as the
+    waveform page picks), and skymaps for every analysis that has one.
+    """
+    label, published = select_preferred(samples, waveform)
+    record = EventRecord(event, label, _columns(published))
+    if label is None:
+        #-- GWTC-1: a single analysis, without waveform metadata
+        return record
+
+    labels = list(samples.samples_dict.keys())
+    approximants = getattr(samples, 'approximant', None) or []
+    for lbl, aprx in zip(labels, approximants):
+        if not isinstance(aprx, str) or aprx in SKIP_APPROXIMANTS:
+            continue
+        if aprx in record.approximant.values():
+            continue
+        # -- Share the arrays of the published analysis, rather than copying
+        if lbl == label:
+            record.analyses[lbl] = record.published
+        else:
+            record.analyses[lbl] = _columns(samples.samples_dict[lbl])
+        record.approximant[lbl] = aprx
+        record.fref[lbl] = get_fref(samples, lbl)
+        try:
+            record.psd[lbl] = {ifo: np.asarray(psd, dtype=np.float64)
+                               for ifo, psd in samples.psd[lbl].items()}
+        except:
+            record.psd[lbl] = {}
+
+    skymaps = getattr(samples, 'skymap', None) or {}
+    for lbl in skymaps.keys():
+        if skymaps[lbl] is not None:
+            record.skymap[lbl] = np.asarray(skymaps[lbl], dtype=np.float64)
+    return record
+
+
+def has_record(event):
+    return _backend().get(record_key(event)) is not None
+
+
+def _aligned(offset):
+    return offset + -offset % ALIGN
+
+
+def save_record(record):
+    """
+    Write a record as: the header length, the header (length of the pickle
+    stream and the offset and size of each array buffer), then from the
+    next ALIGN boundary the pickle stream and the array buffers, each
+    starting on an ALIGN boundary.  Offsets are from that first boundary.
+    """
+    buffers = []
+    data = pickle.dumps(record, protocol=5, buffer_callback=buffers.append)
+    buffers = [buf.raw() for buf in buffers]
+
+    offsets, offset = [], len(data)
+    for buf in buffers:
+        offset = _aligned(offset)
+        offsets.append((offset, buf.nbytes))
+        offset += buf.nbytes
+    header = pickle.dumps((len(data), offsets))
+
+    backend = _backend()
+    key = record_key(record.event)
+    path = backend.local_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.pkl')
+    with os.fdopen(fd, 'wb') as fileout:
+        fileout.write(struct.pack('<Q', len(header)))
+        fileout.write(header)
+        base = _aligned(fileout.tell())
+        fileout.write(bytes(base - fileout.tell()))
+        fileout.write(data)
+        for (offset, nbytes), buf in zip(offsets, buffers):
+            fileout.write(bytes(base + offset - fileout.tell()))
+            fileout.write(buf)
+    size = os.path.getsize(tmpname)
+    backend.put(key, tmpname, move=True)
+    get_manager().add('records', key, size)
+
+
+def read_record(path):
+    # -- Memory map a record file; its arrays are read-only views of the map
+    with open(path, 'rb') as filein:
+        mapped = mmap.mmap(filein.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    hlen, = struct.unpack('<Q', view[:8])
+    datalen, offsets = pickle.loads(view[8:8 + hlen])
+    base = _aligned(8 + hlen)
+    buffers = [view[base + offset:base + offset + nbytes] for offset, nbytes in offsets]
+    return pickle.loads(view[base:base + datalen], buffers=buffers)
+
+
+def load_record(event):
+    # -- The stored EventRecord for event, memory mapped, or None
+    key = record_key(event)
+    path = _backend().get(key)
+    if path is None:
+        get_manager().miss('records', key)
+        return None
+    try:
+        record = read_record(path)
+    except:
+        #-- Unreadable or truncated entry; treat as a miss
+        get_manager().miss('records', key)
+        return None
+    get_manager().hit('records', key, path)
+    return record
@@ -0,0 +1,62 @@
+import io
+import numpy as np
+
+# -- Download formats: file extension and MIME type
+EXPORT_FORMATS = {
+    'CSV': ('csv', 'text/csv'),
+    'NPY': ('npy', 'application/octet-stream'),
+    'HDF5': ('hdf5', 'application/x-hdf5'),
+    }
+
+
+def csv_bytes(times, values, header='Time,Strain'):
+    # -- Format every row with a single %-operation instead of a Python loop
+    data = np.column_stack([times, values])
+    rowfmt = '%.6f,%.10e\n'
+    text = header + '\n' + (rowfmt * len(data)) % tuple(data.ravel())
+    return text.encode()
+
+
+def npy_bytes(times, values):
+    data = np.empty(len(times), dtype=[('time', 'f8'), ('strain', 'f8')])
+    data['time'] = times
+    data['strain'] = values
+    buffer = io.BytesIO()
+    np.save(buffer, data)
+    return buffer.getvalue()
+
+
+def hdf5_bytes(times, values, name='strain', attrs=None):
+    import h5py
+    buffer = io.BytesIO()
+    with h5py.File(buffer, 'w') as h5file:
+        dset = h5file.create_dataset(name, data=np.asarray(values))
+        dset.attrs['t0'] = times[0]
+        dset.attrs['dt'] = times[1] - times[0] if len(times) > 1 else 0.0
+        for key, value in (attrs or {}).items():
+            dset.attrs[key] = value
+        h5file.create_dataset('time', data=np.asarray(times))
+    return buffer.getvalue()
+
+
+def series_bytes(series, fmt):
+    """
+    Serialize a gwpy TimeSeries in one of EXPORT_FORMATS
+    """
+    times = np.asarray(series.times.value)
+    values = np.asarray(series.value)
+    if fmt == 'CSV':
+        return csv_bytes(times, values)
+    elif fmt == 'NPY':
+        return npy_bytes(times, values)
+    elif fmt == 'HDF5':
+        return hdf5_bytes(times, values, attrs={'name': str(series.name)})
+    raise ValueError('Unknown export format: {0}'.format(fmt))
+
+
+def file_name(basename, fmt):
+    return '{0}.{1}'.format(basename, EXPORT_FORMATS[fmt][0])
+
+
+def mime_type(fmt):
+    return EXPORT_FORMATS[fmt][1]
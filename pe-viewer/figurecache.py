@@ -0,0 +1,95 @@
+import os, json, hashlib, tempfile, threading
+
+from cachebackend import get_backend
+from cachemanager import get_manager, register
+
+import render
+
+# -- Rendered figures are kept here as PNG files, named by a hash of
+# -- everything that determines how they look
+FIGDIR = os.environ.get('PEVIEWER_FIGDIR',
+                        os.path.join(os.path.expanduser('~'), '.peviewer', 'figures'))
+
+# -- Bump when the plot functions in render.py change appearance
+FIGURE_VERSION = 2
+
+# -- Libraries whose versions are part of every figure key
+LIBRARIES = ['matplotlib', 'pesummary', 'ligo.skymap', 'numpy', 'scipy']
+
+
+def _backend():
+    return get_backend('figures', FIGDIR)
+
+
+# -- Let the cache manager evict entries to stay within its byte budget
+register('figures', lambda key: _backend().drop_local(key))
+
+
+_versions = None
+_versions_lock = threading.Lock()
+
+def library_versions():
+    global _versions
+    with _versions_lock:
+        if _versions is None:
+            from importlib.metadata import version, PackageNotFoundError
+            _versions = {}
+            for lib in LIBRARIES:
+                try:
+                    _versions[lib] = version(lib)
+                except PackageNotFoundError:
+                    _versions[lib] = None
+        return _versions
+
+
+def figure_key(plot, events, analysis=None, params=None, bounds=None, **options):
+    """
+    Key for a figure: plot type, event list, analysis key(s), parameters,
+    KDE bounds and any other drawing options, plus library versions
+    """
+    spec = {'plot': plot, 'events': list(events), 'analysis': analysis,
+            'params': params, 'bounds': bounds, 'options': options,
+            'versions': library_versions(), 'figure_version': FIGURE_VERSION}
+    digest = hashlib.sha1(json.dumps(spec, sort_keys=True, default=str).encode()).hexdigest()
+    return '{0}/{1}/{2}.png'.format(plot, digest[:2], digest)
+
+
+def load_png(key):
+    path = _backend().get(key)
+    if path is None:
+        get_manager().miss('figures', key)
+        return None
+    get_manager().hit('figures', key, path)
+    with open(path, 'rb') as filein:
+        return filein.read()
+
+
+def save_png(key, png):
+    backend = _backend()
+    path = backend.local_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.png')
+    with os.fdopen(fd, 'wb') as fileout:
+        fileout.write(png)
+    backend.put(key, tmpname, move=True)
+    get_manager().add('figures', key, len(png))
+
+
+def cached_figure(key, func, *args, inputs=None, **kwargs):
+    """
+    PNG bytes for key, rendering func(*args, **kwargs) with render.render
+    on a miss.  inputs, if given, is a callable returning more positional
+    arguments, called only on a miss, so costly inputs such as a skymap are
+    not fetched for a figure which is already cached.
+    """
+    png = load_png(key)
+    if png is None:
+        if inputs is not None:
+            args = args + tuple(inputs())
+        png = render.render(func, *args, **kwargs)
+        try:
+            save_png(key, png)
+        except OSError:
+            #-- Cache is not writable; still show the figure
+            pass
+    return png
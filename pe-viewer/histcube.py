@@ -0,0 +1,71 @@
+import numpy as np
+
+# -- Per-event histograms and bounded KDE curves for every parameter in
+# -- ALL_PARAM, computed once when samples enter the store.  Histograms use
+# -- fine bins, so they can be rebinned onto edges shared by several events.
+CUBE_FILE = 'hist.npz'
+FINE_BINS = 400
+KDE_POINTS = 200
+
+
+def kde_method(param):
+    # -- Same boundary treatment as the Select Parameters tab
+    return 'Transform' if param == 'chi_p' else 'Reflection'
+
+
+def param_bounds(param):
+    from pesummary.gw.plots.bounds import default_bounds
+    bounds = default_bounds.get(param, {})
+    return bounds.get('low', None), bounds.get('high', None)
+
+
+def kde_curve(values, param, npoints=KDE_POINTS):
+    from kde import bounded_1d_kde
+    xlow, xhigh = param_bounds(param)
+    grid = np.linspace(values.min(), values.max(), npoints)
+    kde = bounded_1d_kde(values, method=kde_method(param), xlow=xlow, xhigh=xhigh)
+    return grid, kde(grid)
+
+
+def build_cube(columns, params):
+    """
+    Return a dictionary of arrays, suitable for np.savez, with
+    '<param>.edges', '<param>.counts', '<param>.kde_x' and '<param>.kde_y'
+    for each of params found in columns
+    """
+    cube = {}
+    for param in params:
+        if param not in columns: continue
+        values = np.asarray(columns[param], dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if len(values) == 0: continue
+
+        counts, edges = np.histogram(values, bins=FINE_BINS)
+        cube[param + '.edges'] = edges
+        cube[param + '.counts'] = counts
+
+        try:
+            cube[param + '.kde_x'], cube[param + '.kde_y'] = kde_curve(values, param)
+        except Exception:
+            #-- e.g. a parameter fixed at a single value
+            pass
+    return cube
+
+
+def shared_edges(cubes, param, nbins=50):
+    # -- Bin edges spanning param in every cube, so histograms line up
+    low = min(cube[param + '.edges'][0] for cube in cubes)
+    high = max(cube[param + '.edges'][-1] for cube in cubes)
+    return np.linspace(low, high, nbins + 1)
+
+
+def rebin(cube, param, edges):
+    """
+    Probability density of param on new bin edges, interpolating the
+    cumulative distribution of the fine histogram
+    """
+    fine_edges = cube[param + '.edges']
+    counts = cube[param + '.counts']
+    cdf = np.concatenate([[0], np.cumsum(counts)]) / counts.sum()
+    mass = np.diff(np.interp(edges, fine_edges, cdf, left=0, right=1))
+    return mass / np.diff(edges)
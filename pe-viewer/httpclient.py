@@ -0,0 +1,143 @@
+"""
+One HTTP client for all upstream requests: the GWOSC catalog and event
+JSON, and the DCC and zenodo file downloads.
+
+Requests go through a shared requests.Session, which keeps a pool of open
+connections per host, with a connect and read timeout on every request
+and bounded retries (with backoff, honouring Retry-After) for connection
+errors and 429/5xx responses.  JSON documents are also kept on disk with
+their ETag and Last-Modified headers; later requests revalidate them with
+If-None-Match / If-Modified-Since, and a stored copy is used if the
+upstream is unreachable.
+
+    PEVIEWER_GWOSC_URL      GWOSC server (default https://gwosc.org), e.g. a mock server
+    PEVIEWER_HTTP_TIMEOUT   connect and read timeouts in seconds (default 5,30)
+    PEVIEWER_HTTP_RETRIES   retries per request (default 3)
+    PEVIEWER_HTTPDIR        where JSON responses are kept
+"""
+import os, json, hashlib, tempfile, threading, time
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from cachebackend import get_backend
+from cachemanager import get_manager, register
+import metrics
+
+GWOSC_URL = os.environ.get('PEVIEWER_GWOSC_URL', 'https://gwosc.org').rstrip('/')
+
+TIMEOUT = tuple(float(t) for t in os.environ.get('PEVIEWER_HTTP_TIMEOUT', '5,30').split(','))
+RETRIES = int(os.environ.get('PEVIEWER_HTTP_RETRIES', 3))
+
+HTTPDIR = os.environ.get('PEVIEWER_HTTPDIR',
+                         os.path.join(os.path.expanduser('~'), '.peviewer', 'http'))
+
+# -- Open connections kept per host
+POOL_SIZE = 16
+
+
+def _backend():
+    return get_backend('http', HTTPDIR)
+
+
+# -- Let the cache manager evict entries to stay within its byte budget
+register('http', lambda key: _backend().drop_local(key))
+
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(total=RETRIES, backoff_factor=0.5,
+                          status_forcelist=[429, 500, 502, 503, 504],
+                          allowed_methods=['GET', 'HEAD'],
+                          respect_retry_after_header=True, raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE,
+                                  max_retries=retry)
+            _session = requests.Session()
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+        return _session
+
+
+def get(url, **kwargs):
+    """
+    requests.get through the shared session, with the default timeouts;
+    a drop-in getter for download.stream_download
+    """
+    kwargs.setdefault('timeout', TIMEOUT)
+    return get_session().get(url, **kwargs)
+
+
+def _json_key(url):
+    return 'json/' + hashlib.sha1(url.encode()).hexdigest() + '.json'
+
+
+def _read_entry(key):
+    path = _backend().get(key)
+    if path is None:
+        return None
+    try:
+        with open(path) as filein:
+            return json.load(filein)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_entry(key, entry):
+    backend = _backend()
+    path = backend.local_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.json')
+    with os.fdopen(fd, 'w') as fileout:
+        json.dump(entry, fileout)
+    size = os.path.getsize(tmpname)
+    backend.put(key, tmpname, move=True)
+    get_manager().add('http', key, size)
+
+
+def get_json(url, max_age=0):
+    """
+    The JSON document at url.  A copy stored less than max_age seconds ago
+    is used as is; an older one is revalidated with the server, and used if
+    the server cannot be reached.
+    """
+    key = _json_key(url)
+    entry = _read_entry(key)
+    if entry is not None and time.time() - entry['fetched'] < max_age:
+        get_manager().hit('http', key, _backend().local_path(key))
+        return entry['body']
+
+    headers = {}
+    if entry is not None:
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+    try:
+        r = get(url, headers=headers)
+        if r.status_code == 304 and entry is not None:
+            get_manager().hit('http', key, _backend().local_path(key))
+        else:
+            r.raise_for_status()
+            metrics.inc('peviewer_download_bytes_total', len(r.content), host=urlparse(url).netloc)
+            get_manager().miss('http', key)
+            entry = {'url': url, 'body': r.json(), 'etag': r.headers.get('ETag'),
+                     'last_modified': r.headers.get('Last-Modified')}
+    except (requests.RequestException, ValueError):
+        #-- Upstream is down or slow; fall back to the stored copy
+        if entry is None:
+            raise
+        return entry['body']
+
+    entry['fetched'] = time.time()
+    try:
+        _write_entry(key, entry)
+    except OSError:
+        pass
+    return entry['body']
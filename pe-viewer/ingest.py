@@ -0,0 +1,247 @@
+"""
+Turn PE release files into the per-event artifacts the app reads: the
+published samples, with their histograms and summary statistics, in the
+sample store, the EventRecord, and the skymaps with their credible
+regions.  Files are processed in parallel, one worker process per core.
+A manifest of what was written is kept next to the sample store, and the
+catalog-wide summary table is rebuilt at the end.
+
+    python ingest.py ~/zenodo/gwtc3/*.h5             # GWTC-2.1/3/4.1 release files
+    python ingest.py --catalog GWTC-1-confident ~/dcc/GWTC-1/
+    python ingest.py --waveform C01:Mixed --event GW191109_010717 file.h5
+
+Each file is matched to its event, preferred waveform and catalog through
+the GWOSC catalog, by file name.  Without network access, give --waveform
+(and --event for files not named after their event).
+"""
+import argparse, glob, json, multiprocessing, os, re, tempfile, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import eventrecord
+import histcube
+import samplestore
+import skymapstore
+import summarytable
+from render import available_cpus
+
+CATALOGS = ['GWTC-4.1', 'GWTC-3-confident', 'GWTC-2.1-confident', 'GWTC-1-confident']
+
+MANIFEST = os.environ.get('PEVIEWER_MANIFEST',
+                          os.path.join(os.path.dirname(samplestore.STOREDIR), 'manifest.json'))
+
+# -- Release file names contain the full event name, e.g.
+# -- IGWN-GWTC2p1-v2-GW150914_095045_PEDataRelease_mixed_cosmo.h5 or GW150914_GWTC-1.hdf5
+EVENT_NAME = re.compile(r'GW\d{6}(?:_\d{6})?')
+
+
+def store_samples(record, meta, params, overwrite=False):
+    # -- Write the published samples of a record, with their histograms and
+    # -- summary statistics, to the sample store
+    with samplestore.lock(record.event):
+        if overwrite or not samplestore.has_event(record.event):
+            extras = {histcube.CUBE_FILE: histcube.build_cube(record.published, params),
+                      summarytable.SUMMARY_FILE: summarytable.summarize(record.published, params)}
+            samplestore.write_event(record.event, record.published, meta, extras=extras)
+
+
+def ingest_file(path, event, waveform, params, catalog=None, url=None, nsamples=2000,
+                overwrite=False):
+    """
+    Read one release file and write the artifacts for its event.  Runs in
+    a worker process; returns the manifest entry.
+    """
+    start = time.time()
+    samples = eventrecord.read_release_file(event, path, nsamples)
+    record = eventrecord.project(event, samples, waveform)
+    del samples
+
+    meta = {'label': record.label, 'waveform': waveform, 'catalog': catalog, 'url': url}
+    store_samples(record, meta, params, overwrite=overwrite)
+    eventrecord.save_record(record)
+
+    skymaps = {}
+    for label, prob in record.skymap.items():
+        key = skymapstore.skymap_key(event, label)
+        skymapstore.save_skymap(key, prob, source=label)
+        skymaps[label] = key
+
+    return {'event': event, 'source': os.path.abspath(path), 'size': os.path.getsize(path),
+            'catalog': catalog, 'url': url, 'waveform': waveform, 'label': record.label,
+            'nsamples': len(next(iter(record.published.values()), [])),
+            'parameters': len(record.published), 'analyses': list(record.analyses),
+            'record': eventrecord.record_key(event), 'skymaps': skymaps,
+            'seconds': round(time.time() - start, 2)}
+
+
+def find_files(paths):
+    # -- Release files given directly, or found below directories
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for ext in ['h5', 'hdf5']:
+                files += glob.glob(os.path.join(path, '**', '*.' + ext), recursive=True)
+        else:
+            files.append(path)
+    return sorted(set(files))
+
+
+def catalog_files(catalogs):
+    # -- Release file name -> (event, waveform, catalog, url), from the GWOSC catalog
+    import peutils
+    known = {}
+    for event in peutils.get_eventlist(catalog=catalogs):
+        try:
+            url, waveform, catalog = peutils.get_pe_url(event)
+            source, getter = peutils.get_samples_source(event)
+        except Exception:
+            continue
+        known[peutils.release_file_name(source)] = (event, waveform, catalog, url)
+    return known
+
+
+def plan(files, catalogs=CATALOGS, waveform=None, event=None):
+    """
+    Match files to events.  Returns a list of (path, event, waveform,
+    catalog, url) and a dictionary of path -> reason for files that could
+    not be matched.
+    """
+    known = {}
+    if waveform is None:
+        try:
+            known = catalog_files(catalogs)
+        except Exception as exc:
+            print('GWOSC catalog unavailable ({0}); use --waveform'.format(exc))
+
+    jobs, skipped = [], {}
+    for path in files:
+        fn = os.path.basename(path)
+        if fn in known and event is None:
+            jobs.append((path,) + known[fn])
+            continue
+        name = event or (EVENT_NAME.findall(fn) or [None])[0]
+        if name is None:
+            skipped[path] = 'no event name in the file name; use --event'
+        elif waveform is None:
+            skipped[path] = 'not in the GWOSC catalog; use --waveform'
+        else:
+            jobs.append((path, name, waveform, None, None))
+    return jobs, skipped
+
+
+def read_manifest(path=MANIFEST):
+    try:
+        with open(path) as filein:
+            return json.load(filein)
+    except (OSError, ValueError):
+        return {'events': {}, 'failed': {}}
+
+
+def write_manifest(manifest, path=MANIFEST):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.json')
+    with os.fdopen(fd, 'w') as fileout:
+        json.dump(manifest, fileout, indent=1, sort_keys=True)
+    os.replace(tmpname, path)
+
+
+def library_versions():
+    from importlib.metadata import version
+    return {lib: version(lib) for lib in ['pesummary', 'numpy', 'h5py']}
+
+
+def ingest(jobs, params, workers=None, nsamples=2000, force=False, manifest_path=MANIFEST,
+           progress=None):
+    """
+    Run ingest_file for each job in a pool of worker processes, and update
+    the manifest.  progress, if given, is called as progress(count, event,
+    error) as each file finishes.
+    """
+    manifest = read_manifest(manifest_path)
+    manifest.setdefault('events', {})
+    manifest.setdefault('failed', {})
+
+    todo, count = [], 0
+    for job in jobs:
+        event = job[1]
+        if not force and event in manifest['events'] and samplestore.has_event(event) \
+                and eventrecord.has_record(event):
+            count += 1
+            if progress is not None:
+                progress(count, event, None)
+            continue
+        todo.append(job)
+
+    # -- spawn, so workers do not inherit the parent's open HTTP and sqlite state
+    workers = workers or available_cpus()
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = {}
+        for path, event, waveform, catalog, url in todo:
+            future = pool.submit(ingest_file, path, event, waveform, params, catalog=catalog,
+                                 url=url, nsamples=nsamples, overwrite=force)
+            futures[future] = (path, event)
+        for future in as_completed(futures):
+            path, event = futures[future]
+            count += 1
+            error = None
+            try:
+                manifest['events'][event] = future.result()
+                manifest['failed'].pop(path, None)
+            except Exception as exc:
+                error = '{0}: {1}'.format(type(exc).__name__, exc)
+                manifest['failed'][path] = {'event': event, 'error': error}
+            if progress is not None:
+                progress(count, event, error)
+
+    manifest.update({'updated': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                     'store_version': samplestore.STORE_VERSION,
+                     'record_version': eventrecord.RECORD_VERSION,
+                     'nsamples': nsamples, 'versions': library_versions()})
+    write_manifest(manifest, manifest_path)
+
+    # -- Refresh the catalog-wide summary table
+    summarytable.build_table(params)
+    return manifest
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='+', help='release files, or directories to search')
+    parser.add_argument('--catalog', action='append', choices=CATALOGS,
+                        help='catalog to match files against, may be repeated (default: all)')
+    parser.add_argument('--waveform', help='analysis label to publish, skipping the GWOSC lookup')
+    parser.add_argument('--event', help='event name, for a single file not named after its event')
+    parser.add_argument('--workers', type=int, help='number of worker processes (default: cores)')
+    parser.add_argument('--samples', type=int, default=2000, help='samples to keep per analysis')
+    parser.add_argument('--manifest', default=MANIFEST, help='manifest file to update')
+    parser.add_argument('--force', action='store_true', help='rewrite events already ingested')
+    opts = parser.parse_args(args)
+
+    files = find_files(opts.paths)
+    if opts.event and len(files) > 1:
+        parser.error('--event needs a single file')
+    jobs, skipped = plan(files, catalogs=opts.catalog or CATALOGS, waveform=opts.waveform,
+                         event=opts.event)
+    for path, reason in sorted(skipped.items()):
+        print('SKIPPED {0}: {1}'.format(path, reason))
+
+    # -- Imported here, as it pulls in streamlit
+    from peutils import ALL_PARAM
+    total = len(jobs)
+    start = time.time()
+
+    def update(count, ev, error):
+        status = 'FAILED ' + error if error else 'ok'
+        print('[{0}/{1}] {2} {3}'.format(count, total, ev, status), flush=True)
+
+    manifest = ingest(jobs, ALL_PARAM, workers=opts.workers, nsamples=opts.samples,
+                      force=opts.force, manifest_path=opts.manifest, progress=update)
+    failed = [job[0] for job in jobs if job[0] in manifest['failed']]
+    print('Ingested {0} files in {1:.0f} s, {2} failed, {3} skipped; manifest: {4}'.format(
+        total - len(failed), time.time() - start, len(failed), len(skipped), opts.manifest))
+    return 1 if failed or skipped else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,313 @@
+"""
+Binned Gaussian kernel density estimates with bounded domains.
+
+These are drop-in replacements for the pesummary KDEs used by the plots
+(bounded_1d_kde and Bounded_2d_kde), with the same bandwidth rule as
+scipy.stats.gaussian_kde.  Instead of summing a kernel for every sample
+at every evaluation point, the samples are binned onto a fine grid and
+convolved with the kernel by FFT; evaluation then interpolates the grid.
+The boundaries are handled exactly as in pesummary: by reflection about
+xlow/xhigh (and ylow/yhigh), or, with method='Transform', in logit space.
+
+The convolved grid depends only on the samples and the bandwidth, so it
+is memoized: replotting the same event and parameters reuses it.
+"""
+import hashlib, threading
+from collections import OrderedDict
+
+import numpy as np
+from scipy.signal import fftconvolve
+from scipy.ndimage import map_coordinates
+
+# -- Grid points per dimension, and kernel extent in bandwidths
+GRID_POINTS = {1: 4096, 2: 512}
+TAIL = 6
+
+# -- Memoized density grids, keyed on the samples, weights and bandwidth
+GRID_CACHE_SIZE = 64
+_grids = OrderedDict()
+_grids_lock = threading.Lock()
+
+
+def _linear_binning(pts, weights, low, delta, nbins):
+    # -- Share each sample between the 2**d surrounding grid points
+    ndim = len(pts)
+    pos = (pts - low[:, None]) / delta[:, None]
+    index = np.floor(pos).astype(int)
+    frac = pos - index
+    counts = np.zeros(nbins ** ndim)
+    for corner in np.ndindex(*(2,) * ndim):
+        corner = np.array(corner)[:, None]
+        idx = np.clip(index + corner, 0, nbins - 1)
+        w = weights * np.prod(np.where(corner, frac, 1 - frac), axis=0)
+        counts += np.bincount(np.ravel_multi_index(idx, (nbins,) * ndim), w,
+                              minlength=nbins ** ndim)
+    return counts.reshape((nbins,) * ndim)
+
+
+class BinnedKDE:
+    """
+    Gaussian KDE of 1-D or 2-D samples, evaluated by binned FFT convolution.
+    The interface follows scipy.stats.gaussian_kde: dataset has shape
+    (d, n), and bw_method may be 'scott', 'silverman', a number or a
+    function of the KDE.
+    """
+    def __init__(self, dataset, bw_method=None, weights=None):
+        self.dataset = np.atleast_2d(np.asarray(dataset, dtype=np.float64))
+        self.d, self.n = self.dataset.shape
+        if self.d not in GRID_POINTS:
+            raise ValueError('BinnedKDE supports 1 or 2 dimensions')
+        if weights is None:
+            self.weights = np.full(self.n, 1.0 / self.n)
+        else:
+            weights = np.asarray(weights, dtype=np.float64)
+            self.weights = weights / weights.sum()
+        self.neff = 1.0 / np.sum(self.weights ** 2)
+        self.set_bandwidth(bw_method)
+
+    def scotts_factor(self):
+        return self.neff ** (-1.0 / (self.d + 4))
+
+    def silverman_factor(self):
+        return (self.neff * (self.d + 2.0) / 4.0) ** (-1.0 / (self.d + 4))
+
+    covariance_factor = scotts_factor
+
+    def set_bandwidth(self, bw_method=None):
+        if bw_method is None or bw_method == 'scott':
+            self.factor = self.scotts_factor()
+        elif bw_method == 'silverman':
+            self.factor = self.silverman_factor()
+        elif np.isscalar(bw_method):
+            self.factor = float(bw_method)
+        elif callable(bw_method):
+            self.factor = bw_method(self)
+        else:
+            raise ValueError('Unknown bw_method: {0}'.format(bw_method))
+
+        data_covariance = np.atleast_2d(np.cov(self.dataset, rowvar=1, bias=False,
+                                               aweights=self.weights))
+        self.covariance = data_covariance * self.factor ** 2
+        if not np.all(np.isfinite(self.covariance)) or np.linalg.det(self.covariance) <= 0:
+            raise ValueError('KDE needs samples with a non-zero spread in every dimension')
+
+    def _key(self):
+        digest = hashlib.sha1(self.dataset.tobytes())
+        digest.update(self.weights.tobytes())
+        return digest.hexdigest(), self.factor
+
+    def _make_grid(self):
+        # -- Bin the samples, then convolve with the kernel
+        nbins = GRID_POINTS[self.d]
+        sigma = np.sqrt(np.diag(self.covariance))
+        low = self.dataset.min(axis=1) - TAIL * sigma
+        high = self.dataset.max(axis=1) + TAIL * sigma
+        delta = (high - low) / (nbins - 1)
+        counts = _linear_binning(self.dataset, self.weights, low, delta, nbins)
+
+        halfwidth = np.minimum(np.ceil(TAIL * sigma / delta), nbins - 1).astype(int)
+        offsets = np.meshgrid(*[np.arange(-m, m + 1) * dx for m, dx in zip(halfwidth, delta)],
+                              indexing='ij')
+        offsets = np.stack([offset.ravel() for offset in offsets])
+        inverse = np.linalg.inv(self.covariance)
+        norm = np.sqrt(np.linalg.det(2 * np.pi * self.covariance))
+        kernel = np.exp(-0.5 * np.sum(offsets * (inverse @ offsets), axis=0)) / norm
+        kernel = kernel.reshape(tuple(2 * halfwidth + 1))
+
+        density = fftconvolve(counts, kernel, mode='same')
+        return low, delta, np.clip(density, 0, None)
+
+    def grid(self):
+        """
+        (low, delta, density): the density on a regular grid starting at
+        low with spacing delta in each dimension
+        """
+        key = self._key()
+        with _grids_lock:
+            if key in _grids:
+                _grids.move_to_end(key)
+                return _grids[key]
+        value = self._make_grid()
+        with _grids_lock:
+            _grids[key] = value
+            while len(_grids) > GRID_CACHE_SIZE:
+                _grids.popitem(last=False)
+        return value
+
+    def evaluate(self, points):
+        points = np.atleast_2d(np.asarray(points, dtype=np.float64))
+        if points.shape[0] != self.d and points.shape[1] == self.d:
+            points = points.T
+        low, delta, density = self.grid()
+        coords = (points - low[:, None]) / delta[:, None]
+        return map_coordinates(density, coords, order=1, mode='constant', cval=0.0)
+
+    __call__ = evaluate
+
+    def pdf(self, points):
+        return self.evaluate(points)
+
+
+def clear_grids():
+    with _grids_lock:
+        _grids.clear()
+
+
+class ReflectionBoundedKDE(BinnedKDE):
+    """
+    1-D KDE on [xlow, xhigh], with the kernel mass outside the domain
+    reflected back in (as pesummary's ReflectionBoundedKDE)
+    """
+    def __init__(self, pts, xlow=None, xhigh=None, bw_method=None, weights=None):
+        pts = np.atleast_1d(np.asarray(pts, dtype=np.float64))
+        if pts.ndim != 1:
+            raise TypeError('ReflectionBoundedKDE can only be one-dimensional')
+        super().__init__(pts, bw_method=bw_method, weights=weights)
+        self.xlow = xlow
+        self.xhigh = xhigh
+
+    def evaluate(self, pts):
+        x = np.atleast_1d(np.asarray(pts, dtype=np.float64))
+        pdf = super().evaluate(x[None, :])
+        if self.xlow is not None:
+            pdf += super().evaluate((2 * self.xlow - x)[None, :])
+        if self.xhigh is not None:
+            pdf += super().evaluate((2 * self.xhigh - x)[None, :])
+        return pdf
+
+    def __call__(self, pts):
+        pts = np.atleast_1d(pts)
+        results = self.evaluate(pts)
+        if self.xlow is not None:
+            results[pts < self.xlow] = 0.
+        if self.xhigh is not None:
+            results[pts > self.xhigh] = 0.
+        return results
+
+
+def transform_logit(x, a=0., b=1.):
+    return np.log((x - a) / (b - x))
+
+
+def inverse_transform_logit(y, a=0., b=1.):
+    return (a + b * np.exp(y)) / (1 + np.exp(y))
+
+
+def dydx_logit(x, a=0., b=1.):
+    return (-a + b) / ((a - x) * (-b + x))
+
+
+class TransformBoundedKDE(BinnedKDE):
+    """
+    1-D KDE on [xlow, xhigh], built in logit space and mapped back with
+    the Jacobian (as pesummary's TransformBoundedKDE with its defaults)
+    """
+    def __init__(self, pts, xlow=None, xhigh=None, alpha=1.5, N=100,
+                 bw_method=None, weights=None):
+        pts = np.asarray(pts, dtype=np.float64)
+        inside = (pts > xlow) & (pts < xhigh)
+        if weights is not None:
+            weights = np.asarray(weights)[inside]
+        super().__init__(transform_logit(pts[inside], xlow, xhigh),
+                         bw_method=bw_method, weights=weights)
+        self.xlow = xlow
+        self.xhigh = xhigh
+        self.alpha = alpha
+        self.N = N
+
+    def __call__(self, pts):
+        original = np.atleast_1d(np.asarray(pts, dtype=np.float64))
+        inside = original[(original > self.xlow) & (original < self.xhigh)]
+        if not len(inside):
+            return np.zeros_like(original)
+
+        # -- Same evaluation grid as pesummary, so the results match
+        y = transform_logit(inside, self.xlow, self.xhigh)
+        spread = ((self.alpha - 1.) / 2) * (np.max(y) - np.min(y))
+        y = np.linspace(np.min(y) - spread, np.max(y) + spread, self.N)
+        x = inverse_transform_logit(y, self.xlow, self.xhigh)
+        Y = self.evaluate(y[None, :]) * np.abs(dydx_logit(x, self.xlow, self.xhigh))
+
+        result = np.zeros(len(original))
+        usable = (original > np.amin(x)) & (original < np.amax(x))
+        result[usable] = np.interp(original[usable], x, Y)
+        return result
+
+
+def bounded_1d_kde(pts, method='Reflection', xlow=None, xhigh=None, *args, **kwargs):
+    """
+    Return a bounded 1-D KDE; the same interface as pesummary's bounded_1d_kde
+    """
+    kdes = {'Reflection': ReflectionBoundedKDE, 'Transform': TransformBoundedKDE}
+    if method not in kdes:
+        raise ValueError('Unknown method: {0}'.format(method))
+    return kdes[method](pts, xlow=xlow, xhigh=xhigh, *args, **kwargs)
+
+
+class Bounded_2d_kde(BinnedKDE):
+    """
+    2-D KDE on a rectangle, with reflections about each edge and corner
+    (as pesummary's Bounded_2d_kde)
+    """
+    def __init__(self, pts, xlow=None, xhigh=None, ylow=None, yhigh=None,
+                 transform=None, bw_method=None, weights=None):
+        pts = np.atleast_2d(pts)
+        self._transform = transform
+        if transform is not None:
+            pts = transform(pts)
+        super().__init__(pts, bw_method=bw_method, weights=weights)
+        self.xlow = xlow
+        self.xhigh = xhigh
+        self.ylow = ylow
+        self.yhigh = yhigh
+
+    def evaluate(self, pts):
+        pts = np.atleast_2d(pts)
+        if pts.shape[0] != 2 and pts.shape[1] == 2:
+            pts = pts.T
+        x, y = pts
+        xs = [x] + [2 * edge - x for edge in [self.xlow, self.xhigh] if edge is not None]
+        ys = [y] + [2 * edge - y for edge in [self.ylow, self.yhigh] if edge is not None]
+        pdf = np.zeros(len(x))
+        for xr in xs:
+            for yr in ys:
+                pdf += super().evaluate(np.vstack([xr, yr]))
+        return pdf
+
+    def __call__(self, pts):
+        pts = np.atleast_2d(pts)
+        if pts.shape[0] != 2 and pts.shape[1] == 2:
+            pts = pts.T
+        if self._transform is not None:
+            pts = self._transform(pts)
+        x, y = pts
+        out_of_bounds = np.zeros(len(x), dtype=bool)
+        if self.xlow is not None:
+            out_of_bounds |= x < self.xlow
+        if self.xhigh is not None:
+            out_of_bounds |= x > self.xhigh
+        if self.ylow is not None:
+            out_of_bounds |= y < self.ylow
+        if self.yhigh is not None:
+            out_of_bounds |= y > self.yhigh
+        results = self.evaluate(pts)
+        results[out_of_bounds] = 0.
+        return results
+
+
+def triangle_kwargs(parameters):
+    """
+    KDE arguments for a reverse triangle plot of two parameters, with the
+    same bounds and transform pesummary's gw module would use.  Pass these
+    with module='core', since the gw module substitutes its own KDEs.
+    """
+    from pesummary.gw.plots.publication import _return_bounds
+    transform, xlow, xhigh, ylow, yhigh = _return_bounds(parameters)
+    kwargs = {'kde': bounded_1d_kde,
+              'kde_2d': Bounded_2d_kde,
+              'kde_2d_kwargs': {'transform': transform, 'xlow': xlow, 'xhigh': xhigh,
+                                'ylow': ylow, 'yhigh': yhigh}}
+    _, xlow, xhigh, ylow, yhigh = _return_bounds(parameters, T=False)
+    kwargs['kde_kwargs'] = {'x_axis': {'xlow': xlow, 'xhigh': xhigh},
+                            'y_axis': {'xlow': ylow, 'xhigh': yhigh}}
+    return kwargs
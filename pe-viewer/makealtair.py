@@ -1,21 +1,34 @@
 import streamlit as st
-from pesummary.io import read
-import numpy as np
 import altair as alt
 import pandas as pd
-import gwpy
-from scipy import signal
-import io
-from scipy.io import wavfile
-from copy import deepcopy
 
-import os
-import base64
-
-from gwosc import datasets
-from peutils import *
-import pesummary
-from peutils import *
+from peutils import ALL_PARAM, get_hist_cube, get_pe_url
+from pesummary.utils.samples_dict import latex_labels
+import histcube
+import metrics
+
+# -- Groups of parameters for the All Parameters page.  Anything in
+# -- ALL_PARAM not listed here is shown under 'Other'
+PARAM_GROUPS = {
+    'Masses': ['mass_1', 'mass_2', 'mass_1_source', 'mass_2_source',
+               'chirp_mass', 'chirp_mass_source', 'total_mass', 'total_mass_source',
+               'mass_ratio', 'inverted_mass_ratio', 'symmetric_mass_ratio',
+               'final_mass', 'final_mass_source', 'final_mass_non_evolved',
+               'final_mass_source_non_evolved'],
+    'Spins': ['chi_eff', 'chi_p', 'a_1', 'a_2', 'cos_tilt_1', 'cos_tilt_2',
+              'tilt_1', 'tilt_2', 'phi_12', 'phi_jl', 'spin_1x', 'spin_1y',
+              'spin_1z', 'spin_2x', 'spin_2y', 'spin_2z', 'final_spin',
+              'final_spin_non_evolved'],
+    'Distances': ['luminosity_distance', 'comoving_distance', 'redshift'],
+    'Angles': ['ra', 'dec', 'theta_jn', 'cos_theta_jn', 'iota', 'cos_iota',
+               'psi', 'psiJ', 'phase', 'phi_1', 'phi_2'],
+    }
+
+def group_params(group, paramlist):
+    if group == 'Other':
+        grouped = set(sum(PARAM_GROUPS.values(), []))
+        return [param for param in paramlist if param not in grouped]
+    return [param for param in PARAM_GROUPS[group] if param in paramlist]
 
 def get_params_intersect(sample_dict, chosenlist):
     allparams = set(sample_dict[chosenlist[0]].parameters)
@@ -30,6 +43,7 @@ def get_params_intersect(sample_dict, chosenlist):
     paramlist.sort()
     return paramlist
         
+@metrics.timed('make_altair_plots')
 def make_altair_plots(chosenlist, sample_dict):
 
     st.markdown("""
@@ -53,21 +67,37 @@ def make_altair_plots(chosenlist, sample_dict):
 
     # -- Get parameters present in all selected events
     allparams = get_params_intersect(sample_dict, chosenlist)
-    
+
+    # -- Only the charts for one group (or a hand-picked list) are made
+    groups = list(PARAM_GROUPS) + ['Other', 'Choose ...']
+    group = st.segmented_control('Parameters', groups, default='Masses', key='onedim_group')
+    if group == 'Choose ...':
+        plotparams = st.multiselect('Parameters to plot', allparams,
+                                    default=group_params('Masses', allparams)[:2],
+                                    key='onedim_params')
+    else:
+        plotparams = group_params(group or 'Masses', allparams)
+    if not plotparams:
+        st.write("No parameters in this group are available for all selected events.")
+
+    # -- Histograms and KDE curves precomputed when the samples were stored
+    events = [ev for ev in chosenlist if ev is not None]
+    cubes = [get_hist_cube(event, sample_dict) for event in events]
+
     col1, col2 = st.columns(2)
     # -- Loop over parameters
-    for count, param in enumerate(allparams):
-                
+    for count, param in enumerate(plotparams):
+
+        plotcubes = [(event, cube) for event, cube in zip(events, cubes) if param + '.edges' in cube]
+        if not plotcubes: continue
+        bins = histcube.shared_edges([cube for event, cube in plotcubes], param)
+
         chartlist = []
-        for i,event in enumerate(chosenlist):
+        for event, cube in plotcubes:
 
-            if event is None: continue
+            # -- Rebin the fine histogram onto bins shared by all events
+            value = histcube.rebin(cube, param, bins)
 
-            samples = sample_dict[event]
-            
-            # -- Make histogram
-            value, bins = np.histogram(samples[param], bins=50, density=True)
-            
             source = pd.DataFrame({
                 param : bins[1:],
                 'Probability Density': value,
@@ -84,6 +114,18 @@ def make_altair_plots(chosenlist, sample_dict):
 
             chartlist.append(chart)
 
+            # -- Bounded KDE
+            if param + '.kde_x' in cube:
+                kdesource = pd.DataFrame({
+                    param : cube[param + '.kde_x'],
+                    'Probability Density': cube[param + '.kde_y'],
+                    'Event': len(cube[param + '.kde_x'])*[event]
+                })
+                chartlist.append(alt.Chart(kdesource).mark_line().encode(
+                    alt.X(param),
+                    alt.Y('Probability Density'),
+                    color='Event:N'))
+
         allchart = chartlist[0]
         for chart in chartlist[1:]:
             allchart+=chart
@@ -91,7 +133,7 @@ def make_altair_plots(chosenlist, sample_dict):
         # -- Def
         refurl = 'https://lscsoft.docs.ligo.org/pesummary/reference/gw/parameters.html#:~:text={0}'.format(param)
 
-        unitlabel = samples.all_latex_labels[param]
+        unitlabel = latex_labels.get(param, param)
         
         #st.altair_chart(allchart, use_container_width=True)
         if (count % 2):
@@ -0,0 +1,103 @@
+import streamlit as st
+import pandas as pd
+import altair as alt
+
+from peutils import ALL_PARAM
+import samplestore
+import summarytable
+
+# -- Axis labels of the parameters most often compared across the catalog,
+# -- as in pesummary's latex_labels; others are labelled by name
+LABELS = {
+    'chirp_mass_source': r'$\mathcal{M}^{\mathrm{source}} [M_{\odot}]$',
+    'mass_1_source': r'$m_{1}^{\mathrm{source}} [M_{\odot}]$',
+    'mass_2_source': r'$m_{2}^{\mathrm{source}} [M_{\odot}]$',
+    'total_mass_source': r'$M^{\mathrm{source}} [M_{\odot}]$',
+    'final_mass_source': r'$M_{\mathrm{final}}^{\mathrm{source}} [M_{\odot}]$',
+    'mass_ratio': r'$q$',
+    'chi_eff': r'$\chi_{\mathrm{eff}}$',
+    'chi_p': r'$\chi_{\mathrm{p}}$',
+    'final_spin': r'$a_{\mathrm{final}}$',
+    'luminosity_distance': r'$d_{L} [\mathrm{Mpc}]$',
+    'redshift': r'$z$',
+    'radiated_energy': r'$E_{\mathrm{rad}} [M_{\odot}]$',
+    }
+
+# -- The summary table, re-read only when the file changes
+@st.cache_data(max_entries=2, show_spinner=False)
+def get_summary_table(mtime):
+    return summarytable.read_table()
+
+# -- Events in the sample store; with an object store backend this is a bucket listing
+@st.cache_data(ttl=60, show_spinner=False)
+def get_stored_events():
+    return samplestore.list_events()
+
+def make_population_plots(eventlist):
+
+    st.markdown("""
+    Compare one parameter across every event in the catalog, using the median and 90% credible
+    interval of each event's published samples.  The summaries are precomputed when samples
+    enter the cache, so no sample files are read here.
+    """)
+
+    table = get_summary_table(summarytable.table_mtime())
+    stored = get_stored_events()
+    if table is None or len(table['events']) < len(stored):
+        st.info("The summary table covers {0} of the {1} cached events.".format(
+            0 if table is None else len(table['events']), len(stored)))
+        if st.button('Update summary table', disabled=not stored):
+            with st.spinner(text="Summarizing {0} events ...".format(len(stored))):
+                summarytable.build_table(ALL_PARAM)
+            get_stored_events.clear()
+            st.rerun()
+    if table is None:
+        st.write("Build the cache (Config section, or `python prefetch.py` on the server) to fill the table.")
+        return
+
+    params = list(table['params'])
+    catalogs = sorted(set(table['catalogs']) - {''})
+    col1, col2 = st.columns(2)
+    param = col1.selectbox('Parameter', params, key='pop_param',
+                           index=params.index('chirp_mass_source') if 'chirp_mass_source' in params else 0)
+    # -- Events are filtered by catalog only when the table records their catalogs
+    chosen = None
+    if catalogs:
+        chosen = col2.multiselect('Catalogs', catalogs, default=catalogs, key='pop_catalogs')
+    order = st.radio('Sort events by', ['Name', 'Median'], horizontal=True, key='pop_order')
+    if chosen == []:
+        st.info("Select one or more catalogs to compare their events.")
+        return
+
+    summary = summarytable.param_summary(table, param, chosen)
+    if summary.empty:
+        st.write("No cached events have {0}.".format(param))
+        return
+    if order == 'Median':
+        summary = summary.sort_values('median')
+
+    # -- Highlight the events chosen in the sidebar
+    summary['selected'] = summary['event'].isin(eventlist)
+    label = LABELS.get(param, param)
+    st.markdown("### {0}: {1} events".format(label, len(summary)))
+
+    y = alt.Y('event:N', sort=list(summary['event']), title=None,
+              axis=alt.Axis(labelFontSize=8))
+    base = alt.Chart(summary).encode(y=y, tooltip=['event', 'catalog', 'median', 'lower', 'upper'])
+    interval = base.mark_rule().encode(alt.X('lower:Q', title=param, scale=alt.Scale(zero=False)),
+                                       alt.X2('upper:Q'), color=alt.Color('catalog:N'))
+    median = base.mark_point(filled=True).encode(
+        alt.X('median:Q'), color=alt.Color('catalog:N'),
+        size=alt.condition('datum.selected', alt.value(80), alt.value(15)))
+    st.altair_chart((interval + median).properties(height=max(200, 10*len(summary))),
+                    width='stretch')
+
+    # -- Sum of the per-event posteriors, on bins shared by all events
+    edges, events, density = summarytable.shared_histograms(table, param, chosen)
+    stacked = pd.DataFrame({param: edges[1:], 'Probability Density': density.mean(axis=0)})
+    st.markdown("### Stacked posteriors")
+    st.altair_chart(alt.Chart(stacked).mark_area(opacity=0.5, interpolate='step').encode(
+        alt.X(param), alt.Y('Probability Density')), width='stretch')
+
+    st.download_button('Download table (CSV)', summary.drop(columns='selected').to_csv(index=False),
+                       file_name='{0}_summary.csv'.format(param), mime='text/csv')
@@ -1,13 +1,11 @@
-from peutils import *
 import streamlit as st
 
-import matplotlib
-matplotlib.use('Agg')
-matplotlib.rcParams['text.usetex'] = False
-
-import threading
-lock = threading.RLock()
+import render
+import figurecache
+import skymapstore
+import metrics
 
+@metrics.timed('make_skymap')
 def make_skymap(chosenlist, datadict):
     aprx_dict = {}
     for ev in chosenlist:
@@ -15,26 +13,33 @@ def make_skymap(chosenlist, datadict):
 
         #-- GW170817 is a special case, using GWTC-1 samples
         if 'GW170817' in ev:   
-            from matplotlib.figure import Figure
             url = 'https://dcc.ligo.org/public/0157/P1800381/007/{0}_skymap.fits.gz'.format(ev)
-            with lock:
-                fig = Figure()
-                #ax = fig.subplots(subplot_kw={'projection': 'geo aitoff'})
-                ax = fig.subplots(subplot_kw={'projection': 'astro hours mollweide'})    
-                ax.imshow_hpx(url, cmap='cylon')
-                st.pyplot(fig)
+            key = figurecache.figure_key('skymap', [ev], analysis=url,
+                                         contour=skymapstore.CONTOURS)
+            try:
+                png = figurecache.cached_figure(
+                    key, render.skymap_plot,
+                    inputs=lambda: [skymapstore.get_fits_skymap(ev, url)])
+                st.image(png, width='stretch')
+            except:
+                st.markdown("Failed to generate skymap")
 
         # -- All other events       
         else:         
             data = datadict[ev]
             aprx_dict[ev] = st.radio("Select set of samples to use", data.skymap.keys(), key='aprx_'+ev, format_func=frmt_keyname)
-            with lock:
-
-                try:
-                    fig = data.skymap[aprx_dict[ev]].plot(contour=[50, 90])
-                    st.pyplot(fig[0])
-                except:
-                    st.markdown("Failed to generate skymap")
+            try:
+                # -- The map and its credible regions are stored once, then
+                # -- only looked up and projected when the figure is drawn
+                aprx = aprx_dict[ev]
+                key = figurecache.figure_key('skymap', [ev], analysis=aprx,
+                                             contour=skymapstore.CONTOURS)
+                png = figurecache.cached_figure(
+                    key, render.skymap_plot,
+                    inputs=lambda: [skymapstore.get_skymap(ev, aprx, data.skymap[aprx])])
+                st.image(png, width='stretch')
+            except:
+                st.markdown("Failed to generate skymap")
 
 
         with st.expander('See code'):
@@ -1,34 +1,36 @@
 import streamlit as st
-from pesummary.io import read
 import numpy as np
 import altair as alt
 import pandas as pd
-import gwpy
 from scipy import signal
 import io
 from scipy.io import wavfile
-from copy import deepcopy
 
-import os
-import base64
-
-from gwosc import datasets
-from gwosc.api import fetch_event_json
-from peutils import *
-
-from scipy.interpolate import interp1d
-
-# -- Try download for waveform data
-def get_download_link(signal, filename='waveform.csv'):
-    """
-    Generates a link allowing the data in a pycbc strain timeseries
-    """
-    data_dict = {'Time':signal.times, 'Strain':signal.value}
-    data = pd.DataFrame(data_dict)
-    csv = data.to_csv(index=False)
-    b64 = base64.b64encode(csv.encode()).decode()  # some strings <-> bytes conversions necessary here
-    href = f'<a href="data:file/csv;base64,{b64}" download="{filename}">Download {filename}</a>'
-    return href
+from peutils import get_event_gps, get_event_detectors
+
+import straincache
+import whitening
+import export
+import metrics
+
+# -- Serialized series for download, generated only for the chosen format
+@st.cache_data(max_entries=20, show_spinner=False)
+def get_export_bytes(key, fmt, _series):
+    return export.series_bytes(_series, fmt)
+
+# -- Download button for a time series, with a choice of file format.  key
+# -- is a tuple of everything the series is computed from (event, analysis,
+# -- detector, band, ...); it keys the cached bytes and the widgets
+def download_series(series, basename, key, label='Download'):
+    widget_key = '_'.join(str(item) for item in key)
+    col1, col2 = st.columns([1, 2])
+    fmt = col1.selectbox('Format', list(export.EXPORT_FORMATS), key='fmt_'+widget_key,
+                         label_visibility='collapsed')
+    col2.download_button('{0} {1}'.format(label, export.file_name(basename, fmt)),
+                         data=get_export_bytes(key, fmt, series),
+                         file_name=export.file_name(basename, fmt),
+                         mime=export.mime_type(fmt), key='dl_'+widget_key,
+                         on_click='ignore')
 
 # -- Make audio helper function
 def make_audio_file(bp_data, t0=None, lowpass=False):
@@ -84,50 +86,78 @@ def plot_white_signal(signal, color_num=0, display=True):
 
     return(chart)
 
+# -- Parameters of the maximum likelihood sample of one analysis
+@st.cache_data(max_entries=20, show_spinner=False)
+def get_maxl_params(event, indx, _posterior_samples):
+    maxl_index = _posterior_samples['log_likelihood'].argmax()
+    return {param: float(_posterior_samples[param][maxl_index])
+            for param in _posterior_samples.parameters}
+
+# -- Maximum likelihood waveform, as a dictionary of polarizations if ifo
+# -- is None, or projected onto detector ifo
+@st.cache_data(max_entries=20, show_spinner=False)
+def get_maxl_waveform(event, indx, aprx, f_low, fref, fs, ifo, _posterior_samples):
+    if ifo is None:
+        return _posterior_samples.maxL_td_waveform(aprx, delta_t=1/fs,
+                                                   f_low=f_low, f_ref=fref)
+    return _posterior_samples.maxL_td_waveform(aprx, delta_t=1/fs, f_low=f_low,
+                                               f_ref=fref, project=ifo)
+
+# -- Whitened strain and projected waveforms for all detectors, whitened
+# -- together with the PE PSDs.  The templates are tapered and zero padded;
+# -- the pad only needs to keep the plotted window (dt either side of the
+# -- merger) clear of the whitening filter's settle-in at each end.
+@st.cache_data(max_entries=20, show_spinner=False)
+def get_whitened(event, indx, aprx, f_low, fref, fs, ifos, t0, dt,
+                 _posterior_samples, _psds):
+    timings = {}
+    templates = {}
+    with whitening.timed(timings, 'templates'):
+        padlength = int(np.ceil((straincache.WHITEN_FDURATION + dt) * fs))
+        for ifo in ifos:
+            hp = get_maxl_waveform(event, indx, aprx, f_low, fref, fs, ifo, _posterior_samples)
+            templates[ifo] = hp.taper().pad(padlength)
+
+    white_data, white_temps = straincache.whiten_event(event, ifos, t0, indx, _psds,
+                                                       templates, sample_rate=fs,
+                                                       timings=timings)
+    for stage, seconds in timings.items():
+        metrics.record('waveform_' + stage.replace(' ', '_'), seconds)
+    return white_data, white_temps, timings
+
+@metrics.timed('make_waveform')
 def make_waveform(event, datadict):    
     
+    # -- EventRecord, with the analyses which can be used for waveforms
     pedata = datadict[event]
-    
-    # -- Get dictionary of samples, indexed by run
-    samples_dict = pedata.samples_dict
+    if not pedata.analyses:
+        raise ValueError('No analyses with waveform information for {0}'.format(event))
 
     # Most likely aprx is: 'IMRPhenomXPHM'
-    # -- Clean list of approximates
-    aprxlist =  deepcopy(pedata.approximant)
-
-    for item in pedata.approximant:
-        #-- Remove items where no approxmiant is found
-        if type(item) != str:  aprxlist.remove(item)
-        #-- Remove waveforms with no GPS info
-        if item == 'SEOBNRv4PHM': aprxlist.remove(item) 
+    labels = list(pedata.analyses.keys())
+    aprxlist = [pedata.approximant[label] for label in labels]
                         
     # -- Select corresponding samples
     aprx = st.radio("Select set of samples to use", aprxlist, key='aprx_waveform'+event)
-    indx_num = pedata.approximant.index(aprx)
-    indx = list(samples_dict.keys())[indx_num]
+    indx = labels[aprxlist.index(aprx)]
     st.text('Waveform Family: {0}'.format(aprx))
     st.text('Using samples for {0}'.format(indx))
     
     # -- Get a single run
-    posterior_samples = samples_dict[indx]
+    posterior_samples = pedata.samples_dict(indx)
     
     # -- Get reference frequency
-    try:
-        fref = float(pedata.config[indx]['engine']['fref'])
-    except:
-        fref = float(pedata.config[indx]['config']["reference-frequency"])
+    fref = float(pedata.fref[indx])
         
-    # -- Find the index of max log likelihood
-    st.write("Finding maximum likelihood sample ...")
-    loglike = posterior_samples['log_likelihood']
-    maxl_index = loglike.argmax()
+    # -- Find the max log likelihood sample
+    maxl = get_maxl_params(event, indx, posterior_samples)
     
     # -- Example parameter
-    chirp_mass = posterior_samples['chirp_mass'][maxl_index]
-    mass1 = posterior_samples['mass_1'][maxl_index]
-    mass2 = posterior_samples['mass_2'][maxl_index]
-    chi_eff = posterior_samples['chi_eff'][maxl_index]
-    dist = posterior_samples['luminosity_distance'][maxl_index]
+    chirp_mass = maxl['chirp_mass']
+    mass1 = maxl['mass_1']
+    mass2 = maxl['mass_2']
+    chi_eff = maxl['chi_eff']
+    dist = maxl['luminosity_distance']
     
     st.markdown("#### Detector Frame Waveform Properties:")
     st.write("Mass 1: {0:.2f}".format(mass1), 'M$_{\odot}$')
@@ -142,14 +172,11 @@ def make_waveform(event, datadict):
         f_low = 20
         fs = 4096
 
-    hp_dict = posterior_samples.maxL_td_waveform(aprx,
-                                            delta_t=1/fs,
-                                            f_low=f_low,
-                                            f_ref=fref)
+    hp_dict = get_maxl_waveform(event, indx, aprx, f_low, fref, fs, None, posterior_samples)
 
     hp = hp_dict['h_plus']
  
-    t0 = datasets.event_gps(event)
+    t0 = get_event_gps(event)
     hp_length = len(hp) / fs
     if hp_length > 8:
         hp = hp.crop( t0-7, t0+1 )
@@ -161,18 +188,11 @@ def make_waveform(event, datadict):
     st.audio(make_audio_file(hp))
     
     # -- Make file for download
-    outfile = io.StringIO()
-    outdata = zip(hp.times, hp.value)
-    for t, s in outdata:
-        outfile.write('{0}, {1}\n'.format(t.value, s))
-    
-    url = get_download_link(hp, filename="{0}_waveform.csv".format(event))
-
-    st.markdown(url, unsafe_allow_html=True)
+    download_series(hp, "{0}_{1}_waveform".format(event, aprx),
+                    key=('waveform', event, indx, f_low, fref, fs))
 
     # -- Get detector / gps info
-    detectorlist = list(datasets.event_detectors(event))
-    detectorlist.sort()
+    detectorlist = get_event_detectors(event)
     
     # -- Set plot zoom
     dt = 0.2
@@ -185,50 +205,28 @@ def make_waveform(event, datadict):
     # -- Band-pass controls
     freqrange = st.slider('Band-pass frequency range (Hz)', min_value=10, max_value=2000, value=(30,400), key=event)
     
+    # -- Get whitened strain data, from the cache or the GWOSC archive, and
+    # -- the projected waveforms whitened with the same PSDs
+    psds = {ifo: pedata.psd[indx][ifo] for ifo in detectorlist}
+    white_data, white_temps, timings = get_whitened(event, indx, aprx, f_low, fref, fs,
+                                                    tuple(detectorlist), t0, dt,
+                                                    posterior_samples, psds)
+    st.caption('Prepared {0} detectors in {1:.2f} s ({2:.2f} s per detector): {3}'.format(
+        len(detectorlist), sum(timings.values()), sum(timings.values()) / len(detectorlist),
+        ', '.join('{0} {1:.2f} s'.format(stage, t) for stage, t in timings.items())))
+
     for ifo in detectorlist:
         
         st.markdown("### {0}".format(ifo))
 
-        # -- Get PSD from PE samples
-        psd = pedata.psd[indx]
-        zippedpsd = psd[ifo]
-        psdfreq, psdvalue = zip(*zippedpsd)
-                
-        # -- Get strain data from GWOSC archive
-        straindata = load_strain(t0, ifo)
-        strain = deepcopy(straindata)
-
-        # -- Extrapolate PSD to match data sampling rate
-        fs = int(strain.sample_rate.value)
-        duration = len(strain) * strain.dt.value
-        target_frequencies = np.linspace(0, fs / 2, int(duration * fs / 2), endpoint=False)
-        asdsquare = gwpy.frequencyseries.FrequencySeries(
-            interp1d(psdfreq, psdvalue, bounds_error=False, fill_value=np.inf)(target_frequencies),
-            frequencies=target_frequencies,
-        )        
-        asd = np.sqrt(asdsquare)
-
-        # -- Whiten, bandpass, and crop
-        white_data = strain.whiten(asd=asd)
-        bp_data = white_data.bandpass(freqrange[0], freqrange[1])
+        # -- Bandpass and crop
+        bp_data = white_data[ifo].bandpass(freqrange[0], freqrange[1])
         bp_cropped = bp_data.crop(cropstart, cropend)
-        
-        # -- Project waveform onto detector
-        hp = posterior_samples.maxL_td_waveform(aprx,
-                                            delta_t=1/fs,
-                                            f_low=f_low,
-                                            f_ref=fref,
-                                            project=ifo)
+        white_temp = white_temps[ifo]
 
         st.write(aprx)
-        
-        # -- Taper and zero pad
-        hp = hp.taper()
-        # -- Zero pad
-        hp = hp.pad(60*fs)
 
-        # -- whiten and bandpass template
-        white_temp = hp.whiten(asd=asd)
+        # -- bandpass template
         bp_temp = white_temp.bandpass(freqrange[0], freqrange[1])
         crop_temp = bp_temp.crop(cropstart, cropend)
         
@@ -237,6 +235,10 @@ def make_waveform(event, datadict):
 
         st.altair_chart(chart1+chart2, use_container_width=True)
 
+        download_series(bp_cropped, "{0}_{1}_whitened_{2}-{3}Hz".format(event, ifo, *freqrange),
+                        key=('whitened', event, indx, ifo) + tuple(freqrange),
+                        label='Download whitened strain')
+
     with st.expander("See the code"):
         st.write("""First, download a posterior samples file from the
         [GWTC-2.1](https://zenodo.org/records/6513631) or
@@ -274,14 +276,7 @@ def simple_make_waveform(name, datadict):
     aprx = 'IMRPhenomXPHM'
     fs = 4096
 
-    keys = list(datadict.keys())
-    samples = datadict[keys[0]].samples_dict
-
-    # -- test for single or multiple analyses
-    try:
-        test = samples['ra']
-    except:
-        samples = samples[list(samples.keys())[0]]
+    samples = datadict[name].samples_dict()
 
     # -- Create dummy samples for params missing from GW170817
     dummysamples = [np.zeros(len(samples['ra']))]
@@ -299,7 +294,7 @@ def simple_make_waveform(name, datadict):
 
     hp = hp_dict['h_plus']
  
-    t0 = datasets.event_gps(name)
+    t0 = get_event_gps(name)
     hp_length = len(hp) / fs
     if hp_length > 8:
         hp = hp.crop( t0-7, t0+1 )
@@ -311,10 +306,5 @@ def simple_make_waveform(name, datadict):
     st.audio(make_audio_file(hp))
     
     # -- Make file for download
-    outfile = io.StringIO()
-    outdata = zip(hp.times, hp.value)
-    for t, s in outdata:
-        outfile.write('{0}, {1}\n'.format(t.value, s))
-    
-    url = get_download_link(hp, filename="{0}_waveform.csv".format(name))
-    st.markdown(url, unsafe_allow_html=True)
+    download_series(hp, "{0}_approximate_waveform".format(name),
+                    key=('approximate', name))
@@ -0,0 +1,276 @@
+"""
+Stage timings and counters, to tell where a slow page spends its time.
+
+Spans record the wall-clock time of each stage (downloading and parsing
+release files, fetching strain, drawing plots, ...) into a histogram per
+stage:
+
+    with metrics.span('format_data'):
+        ...
+
+    @metrics.timed('make_skymap')
+    def make_skymap(...):
+
+Counters record cache hits and misses by namespace and bytes downloaded
+by host.  The metrics of this process are served in the Prometheus text
+format, and can also be written to a file for a sidecar or the
+node_exporter textfile collector:
+
+    PEVIEWER_METRICS_PORT   port of the /metrics endpoint (default 9464, 0 to disable)
+    PEVIEWER_METRICS_FILE   file rewritten every METRICS_INTERVAL seconds (default: none)
+
+The last few spans of each Streamlit session are kept as well, for the
+debug panel in the Config section.
+"""
+import os, time, tempfile, threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_PORT = int(os.environ.get('PEVIEWER_METRICS_PORT', 9464))
+METRICS_FILE = os.environ.get('PEVIEWER_METRICS_FILE', '')
+METRICS_INTERVAL = 15
+
+# -- Histogram buckets of the stage durations, in seconds
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# -- Spans kept per session, and sessions kept, for the debug panel
+SESSION_SPANS = 100
+MAX_SESSIONS = 200
+
+HELP = {
+    'peviewer_stage_seconds': ('histogram', 'Wall-clock time of each stage of a page'),
+    'peviewer_stage_errors_total': ('counter', 'Stages which raised an exception'),
+    'peviewer_cache_hits_total': ('counter', 'Cache lookups which found an entry, by cache'),
+    'peviewer_cache_misses_total': ('counter', 'Cache lookups which found no entry, by cache'),
+    'peviewer_download_bytes_total': ('counter', 'Bytes downloaded from upstream, by host'),
+    'peviewer_cache_bytes': ('gauge', 'Bytes held in the caches on this replica\'s local disk'),
+    'peviewer_cache_budget_bytes': ('gauge', 'Byte budget of this replica\'s local caches'),
+    'peviewer_start_time_seconds': ('gauge', 'Start time of the process, in seconds since the epoch'),
+}
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_sessions = OrderedDict()
+_started = time.time()
+
+
+def _labels(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def inc(name, value=1, **labels):
+    # -- Add value to the counter name{labels}
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    # -- Record value in the histogram name{labels}
+    key = (name, _labels(labels))
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [[0] * len(BUCKETS), 0., 0]
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                hist[0][i] += 1
+        hist[1] += value
+        hist[2] += 1
+
+
+def _session_id():
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx(suppress_warning=True)
+    except Exception:
+        return None
+    return ctx.session_id if ctx is not None else None
+
+
+def record(stage, seconds, error=False):
+    """
+    Record that stage took seconds, for the process and for the current
+    Streamlit session, if there is one
+    """
+    observe('peviewer_stage_seconds', seconds, stage=stage)
+    if error:
+        inc('peviewer_stage_errors_total', stage=stage)
+    session = _session_id()
+    if session is None:
+        return
+    with _lock:
+        if session not in _sessions:
+            _sessions[session] = deque(maxlen=SESSION_SPANS)
+            while len(_sessions) > MAX_SESSIONS:
+                _sessions.popitem(last=False)
+        _sessions.move_to_end(session)
+        _sessions[session].append((time.time(), stage, seconds, error))
+
+
+@contextmanager
+def span(stage):
+    # -- Time a block as one run of stage
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException as exc:
+        #-- st.stop and st.rerun raise to end a script run; those are not errors
+        record(stage, time.perf_counter() - start, error=isinstance(exc, Exception))
+        raise
+    record(stage, time.perf_counter() - start)
+
+
+def timed(stage):
+    # -- Decorator timing every call of a function as stage
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def session_spans(session=None):
+    """
+    Spans of a Streamlit session (default: the current one), oldest first,
+    as (time, stage, seconds, error) tuples
+    """
+    session = session or _session_id()
+    with _lock:
+        return list(_sessions.get(session, []))
+
+
+def stage_summary():
+    # -- Number of runs, total and mean seconds of each stage in this process
+    with _lock:
+        items = [(dict(labels).get('stage'), hist[2], hist[1])
+                 for (name, labels), hist in _histograms.items()
+                 if name == 'peviewer_stage_seconds']
+    return [{'stage': stage, 'count': count, 'total': total, 'mean': total / count}
+            for stage, count, total in sorted(items)]
+
+
+# --
+# Prometheus text format
+# --
+
+def _format_labels(labels, extra=()):
+    labels = list(labels) + list(extra)
+    if not labels:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(
+        key, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels) + '}'
+
+
+def _cache_gauges():
+    # -- Local disk usage from this replica's cache accounting; each replica
+    # -- reports its own disk, and nothing for a shared filesystem cache
+    try:
+        from cachemanager import get_manager
+        manager = get_manager()
+        gauges = {('peviewer_cache_bytes', (('namespace', namespace),)): size
+                  for namespace, size in manager.namespace_bytes().items()}
+        if not manager.shared:
+            gauges[('peviewer_cache_budget_bytes', ())] = manager.budget
+        return gauges
+    except Exception:
+        return {}
+
+
+def exposition():
+    # -- All metrics of this process, in the Prometheus text format
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: [list(hist[0]), hist[1], hist[2]] for key, hist in _histograms.items()}
+    gauges = _cache_gauges()
+    gauges[('peviewer_start_time_seconds', ())] = _started
+
+    lines = []
+    names = sorted(set(name for name, labels in list(counters) + list(histograms) + list(gauges)))
+    for name in names:
+        kind, text = HELP.get(name, ('untyped', name))
+        lines.append('# HELP {0} {1}'.format(name, text))
+        lines.append('# TYPE {0} {1}'.format(name, kind))
+        for (metric, labels), value in sorted(list(counters.items()) + list(gauges.items())):
+            if metric == name:
+                lines.append('{0}{1} {2}'.format(name, _format_labels(labels), repr(float(value))))
+        for (metric, labels), (buckets, total, count) in sorted(histograms.items()):
+            if metric != name: continue
+            for bound, n in zip(BUCKETS, buckets):
+                lines.append('{0}_bucket{1} {2}'.format(
+                    name, _format_labels(labels, [('le', repr(float(bound)))]), n))
+            lines.append('{0}_bucket{1} {2}'.format(name, _format_labels(labels, [('le', '+Inf')]),
+                                                    count))
+            lines.append('{0}_sum{1} {2}'.format(name, _format_labels(labels), repr(total)))
+            lines.append('{0}_count{1} {2}'.format(name, _format_labels(labels), count))
+    return '\n'.join(lines) + '\n'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = exposition().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def write_file(path=None):
+    # -- Write the metrics to path atomically, so a reader never sees half a file
+    path = path or METRICS_FILE
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.prom')
+    with os.fdopen(fd, 'w') as fileout:
+        fileout.write(exposition())
+    os.replace(tmpname, path)
+
+
+def _write_loop(path):
+    while True:
+        try:
+            write_file(path)
+        except OSError:
+            pass
+        time.sleep(METRICS_INTERVAL)
+
+
+_server = None
+_writer = None
+_start_lock = threading.Lock()
+
+def start(port=None, path=None):
+    """
+    Serve /metrics on port and start writing the metrics file, once per
+    process; safe to call on every script run.  A port which is already
+    taken (e.g. by another app process) is skipped.
+    """
+    global _server, _writer
+    port = METRICS_PORT if port is None else port
+    path = path or METRICS_FILE
+    with _start_lock:
+        if _server is None and port:
+            try:
+                _server = ThreadingHTTPServer(('', port), _Handler)
+                _server.daemon_threads = True
+            except OSError:
+                _server = False
+            else:
+                threading.Thread(target=_server.serve_forever, name='metrics-server',
+                                 daemon=True).start()
+        if _writer is None and path:
+            _writer = threading.Thread(target=_write_loop, args=(path,), name='metrics-file',
+                                       daemon=True)
+            _writer.start()
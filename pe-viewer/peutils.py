@@ -1,32 +1,21 @@
 import streamlit as st
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-import requests_pelican as rp
 
-import requests, os, io, json
-import tempfile
+import os
 
-from gwpy.timeseries import TimeSeries
-from gwosc.locate import get_urls
-from gwosc import datasets
-from gwosc.api import fetch_event_json
-
-from copy import deepcopy
-import base64
-
-import pesummary
-from pesummary.io import read
-import pesummary.utils.samples_dict
-
-# Use the non-interactive Agg backend, which is recommended as a
-# thread-safe backend.
-# See https://matplotlib.org/3.3.2/faq/howto_faq.html#working-with-threads.
-import matplotlib as mpl
-mpl.use("agg")
+# -- Only light modules are imported here, so the sidebar and About section
+# -- are ready before pesummary, gwpy and ligo.skymap are loaded.  Those are
+# -- imported by the functions (and sections) which use them.
+from download import stream_download
+import httpclient
+import samplestore
+import histcube
+import eventrecord
+import ingest
+import metrics
 
 import threading
-lock = threading.RLock()
+from concurrent.futures import ThreadPoolExecutor, wait
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 # -- Set pelican parameters
 pelicandict = {
@@ -37,20 +26,73 @@ pelicandict = {
     }
 pelicanroot = 'osdf:///gwdata/zenodo/ligo-virgo-kagra'
 
-# -- Query for eventlist
-@st.cache_data
-def get_eventlist(catalog=None, optional=False):
+# -- Catalog index is refreshed from GWOSC after this many seconds
+CATALOG_TTL = 60*60
 
-    eventlist = []
+# -- Zenodo record of each data release, listing the checksums of its
+# -- files; published records change rarely, so they are revalidated daily
+ZENODO_API = 'https://zenodo.org/api/records/'
+RECORD_TTL = 24*60*60
 
-    # -- Get GWTC list
-    url = 'https://gwosc.org/eventapi/json/GWTC/'
-    gwtc = requests.get(url).json()
+# -- Build an index of all GWTC events, keyed by commonName.  The catalog
+# -- JSON does not list PE data URLs or waveform families; those come from
+# -- each event's own JSON, read by get_event_info on first use and kept on
+# -- disk by httpclient, so only an event's first lookup goes to GWOSC
+@st.cache_data(ttl=CATALOG_TTL, show_spinner=False)
+def get_catalog_index():
+    url = httpclient.GWOSC_URL + '/eventapi/json/GWTC/'
+    gwtc = httpclient.get_json(url)
 
+    index = {}
     for event_id, info in gwtc['events'].items():
-        if info['catalog.shortName'] in catalog:
-            if info['mass_1_source'] != None:
-                eventlist.append(info['commonName'])
+        # -- Keep the first entry for each name, as the old linear scan did
+        index.setdefault(info['commonName'], {
+            'event_id': event_id,
+            'catalog': info['catalog.shortName'],
+            'gps': info['GPS'],
+            'jsonurl': info['jsonurl'],
+            'has_source_mass': info['mass_1_source'] != None,
+            })
+    return index
+
+# -- Look up a single event, adding the preferred PE set from the event JSON
+@st.cache_data(ttl=CATALOG_TTL, show_spinner=False)
+def get_event_info(event):
+    entry = get_catalog_index().get(event)
+    if entry is None:
+        return None
+
+    info = dict(entry)
+    eventinfo = httpclient.get_json(info['jsonurl'], max_age=CATALOG_TTL)
+    meta = eventinfo['events'][info['event_id']]
+    info['data_url'], info['waveform_family'] = find_preferred_pe(meta)
+    # -- Detectors with open strain data, as gwosc.datasets.event_detectors
+    info['detectors'] = sorted(set(s['detector'] for s in meta.get('strain', [])))
+    return info
+
+def find_preferred_pe(meta):
+    # -- Find PE data URL for GWTC-1 events
+    if meta['catalog.shortName'] == 'GWTC-1-confident':
+        for peset, peinfo in meta['parameters'].items():
+            if 'R2_pe_combined' in peset:
+                return peinfo['data_url'], peinfo['waveform_family']
+
+    # -- Find PE data URL for all other events
+    for peset, peinfo in meta['parameters'].items():
+        if peinfo['is_preferred'] and (peinfo['pipeline_type'] == 'pe'):
+            return peinfo['data_url'], peinfo['waveform_family']
+
+    return None, None
+
+# -- Query for eventlist
+@st.cache_data(ttl=CATALOG_TTL)
+def get_eventlist(catalog=None, optional=False):
+
+    eventlist = []
+    for name, info in get_catalog_index().items():
+        if info['catalog'] in catalog:
+            if info['has_source_mass']:
+                eventlist.append(name)
         
     eventlist.sort()
     if optional:
@@ -58,89 +100,224 @@ def get_eventlist(catalog=None, optional=False):
     return eventlist
 
 # -- Assemble samples into sample dictionary
-#@st.cache(max_entries=5, suppress_st_warning=True)
+# -- The columns for each event are shared read-only by every session
+@metrics.timed('format_data')
 def format_data(chosenlist, datadict):
-    sample_dict = {}
+    published_dict = {}
     for i,chosen in enumerate(chosenlist, 1):
         if chosen is None: continue
-        samples = datadict[chosen]
-        url, waveform, catalog = get_pe_url(chosen)
-        try:
-            #-- This key should be the preferred samples for GWTC-2.1 and GWTC-3
-            sample_dict[chosen] = samples.samples_dict[waveform]
-            continue
-        except:
-            pass
+        published_dict[chosen] = get_published_samples(chosen, _datadict=datadict)
+    return published_dict
 
+# -- Write the published analysis of an EventRecord to the sample store
+def store_published_samples(event, record, overwrite=False):
+    url, waveform, catalog = get_pe_url(event)
+    meta = {'label': record.label, 'waveform': waveform, 'catalog': catalog, 'url': url}
+    ingest.store_samples(record, meta, ALL_PARAM, overwrite=overwrite)
+    return record.published
+
+# -- Read the published samples for an event, using the sample store when possible
+# -- Returns a samplestore.Columns dictionary of read-only arrays, memory
+# -- mapped from the store, or taken from the event's shared EventRecord
+def load_published_samples(event, datadict=None, params=None):
+    if params is None:
+        params = ALL_PARAM
+
+    if not samplestore.record_access(event):
         try:
-            # KLUDGE for GWTC-4.0
-            sample_dict[chosen] = samples.samples_dict['C00:'+waveform]
-            continue
-        except:
+            store_published_samples(event, datadict[event])
+        except OSError:
+            #-- Store is not writable, so use the in-memory samples
+            published = datadict[event].published
+            return samplestore.Columns((p, published[p]) for p in params if p in published)
+
+    return samplestore.read_columns(event, params)
+
+# -- One copy of the published samples for each event, for all sessions
+@st.cache_resource(max_entries=20, show_spinner=False)
+def get_published_samples(event, _datadict=None):
+    return load_published_samples(event, _datadict)
+
+# -- Histograms and KDE curves for an event, from the sample store if possible
+@st.cache_data(max_entries=50, show_spinner=False)
+def get_hist_cube(event, _sample_dict=None):
+    cube = None
+    if samplestore.has_event(event):
+        cube = samplestore.read_extra(event, histcube.CUBE_FILE)
+    if cube is None:
+        #-- Entries written before the histograms were added
+        if samplestore.has_event(event):
+            columns = samplestore.read_columns(event, ALL_PARAM)
+        else:
+            columns = _sample_dict[event]
+        cube = histcube.build_cube(columns, ALL_PARAM)
+        try:
+            samplestore.write_extra(event, histcube.CUBE_FILE, cube)
+        except OSError:
+            #-- Store is not writable; the cube is still cached in memory
             pass
-        
-        #-- GWTC-1
-        sample_dict[chosen] = samples.samples_dict
-        
-    published_dict = pesummary.utils.samples_dict.MultiAnalysisSamplesDict( sample_dict )
-    return published_dict
+    return cube
 
 # -- Create dictionary of samples
-#@st.cache(max_entries=5, suppress_st_warning=True)
-def make_datadict(chosenlist):
+# -- Events are loaded concurrently, with a progress bar for each in the sidebar.
+# -- Returns the loaded samples, and a dictionary of error messages for any
+# -- events which failed to load.
+def make_datadict(chosenlist, workers=3):
     datadict = {}
-    for ev in chosenlist:
-        with st.spinner(text="Downloading data for {0} ...".format(ev)):
-            datadict[ev] = load_samples_pelican(ev)
-    return datadict
-
-# -- Load PE samples from pelican
-@st.cache_data(max_entries=1, show_spinner=False, persist=True)
-def load_samples_pelican(event, gwtc=True):
-    if gwtc:
-        url, waveform, catalog = get_pe_url(event)
-        spl = url.split('/')
-        if spl[-1] == 'content':
-            fn = spl[-2]
-        else:
-            fn = spl[-1]
-
-    # -- Construct Pelican ID
-    yr, zenid = pelicandict[catalog]
-    pelicanurl = os.path.join(pelicanroot, str(yr), str(zenid), fn)
-        
-    if event != 'GW170817':
-        tfile = tempfile.NamedTemporaryFile(suffix='.h5')
-        tfile.write(rp.get(pelicanurl).content)
-        samples = read(tfile.name, disable_prior=True)
+    failed = {}
+    events = [ev for ev in dict.fromkeys(chosenlist) if ev is not None]
+    progress = {ev: (0, None) for ev in events}
+    ctx = get_script_run_ctx()
+
+    def load(ev):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        def update(done, total):
+            progress[ev] = (done, total)
+        return load_samples_pelican(ev, _progress=update)
+
+    with st.sidebar:
+        bars = {ev: st.progress(0.0, text="{0}: waiting ...".format(ev)) for ev in events}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(load, ev): ev for ev in events}
+        pending = set(futures)
+        while pending:
+            finished, pending = wait(pending, timeout=0.25)
+            for future in finished:
+                ev = futures[future]
+                try:
+                    datadict[ev] = future.result()
+                except Exception as exc:
+                    failed[ev] = '{0}: {1}'.format(type(exc).__name__, exc)
+            for ev, bar in bars.items():
+                show_progress(bar, ev, progress[ev], ev in datadict, ev in failed)
+
+    for bar in bars.values():
+        bar.empty()
+    return datadict, failed
+
+# -- Report download progress on a streamlit progress bar
+def show_progress(bar, ev, progress, done=False, failed=False):
+    nbytes, total = progress
+    if failed:
+        bar.progress(1.0, text="{0}: failed".format(ev))
+    elif done:
+        bar.progress(1.0, text="{0}: loaded".format(ev))
+    elif total:
+        text = "{0}: {1:.0f} / {2:.0f} MB".format(ev, nbytes/1e6, total/1e6)
+        bar.progress(min(nbytes/total, 1.0), text=text)
+    elif nbytes:
+        bar.progress(0.0, text="{0}: {1:.0f} MB".format(ev, nbytes/1e6))
     else:
+        bar.progress(0.0, text="{0}: loading ...".format(ev))
+
+# -- Find where to download the PE release file for an event
+# -- Returns the URL and a requests-style get function for it
+def get_samples_source(event):
+    url, waveform, catalog = get_pe_url(event)
+
+    if event == 'GW170817':
         # Use GWTC-1 samples for only GW170817
         url = 'https://dcc.ligo.org/public/0157/P1800370/005/{0}_GWTC-1.hdf5'.format(event)
-        r = requests.get(url)
-        tfile = tempfile.NamedTemporaryFile(suffix='.h5')
-        tfile.write(r.content)
-        if event == 'GW170817':
-            samples = read(tfile.name, path_to_samples="IMRPhenomPv2NRT_lowSpin_posterior", disable_prior=True)
-        else:
-            samples = read(tfile.name, disable_prior=True)
+        return url, httpclient.get
 
+    fn = release_file_name(url)
+
+    # -- Construct Pelican ID
+    yr, zenid = pelicandict[catalog]
+    pelicanurl = os.path.join(pelicanroot, str(yr), str(zenid), fn)
+    import requests_pelican
+    return pelicanurl, requests_pelican.get
+
+# -- File name of a PE release file, from its zenodo or DCC URL
+def release_file_name(url):
+    spl = url.split('/')
+    if spl[-1] == 'content':
+        return spl[-2]
+    return spl[-1]
+
+# -- Checksum ('md5:...') zenodo publishes for the release file of an
+# -- event, or None if there is none (e.g. DCC files) or it is unavailable
+def get_release_checksum(event):
+    if event == 'GW170817':
+        return None
+    url, waveform, catalog = get_pe_url(event)
+    if catalog not in pelicandict:
+        return None
+    recordurl = ZENODO_API + str(pelicandict[catalog][1])
     try:
-        samples.downsample(2000)
-    except:
-        pass
-    return samples
+        record = httpclient.get_json(recordurl, max_age=RECORD_TTL)
+    except (OSError, ValueError):
+        #-- requests errors are OSErrors; fall back to the size check
+        return None
+    fn = release_file_name(url)
+    for entry in record.get('files', []):
+        if entry.get('key') == fn:
+            return entry.get('checksum')
+    return None
+
+# -- Download the PE release file for an event, returning a local path
+# -- The file is checked against the zenodo checksum where there is one
+def fetch_samples_file(event, progress=None):
+    url, getter = get_samples_source(event)
+    checksum = get_release_checksum(event)
+    with metrics.span('download_samples'):
+        return stream_download(url, getter=getter, suffix='.h5', checksum=checksum,
+                               progress=progress)
+
+# -- Read and downsample a PE release file, and fill the sample store
+# -- Returns an EventRecord with only the parts of the file the app uses
+def read_samples_file(event, fn, overwrite=False):
+    with metrics.span('parse_samples'):
+        samples = eventrecord.read_release_file(event, fn)
+        url, waveform, catalog = get_pe_url(event)
+        record = eventrecord.project(event, samples, waveform)
+        del samples
+
+    # -- Keep the published analysis in the sample store, and the record,
+    # -- for fast reloads
+    with metrics.span('store_samples'):
+        try:
+            store_published_samples(event, record, overwrite=overwrite)
+        except:
+            pass
+        try:
+            eventrecord.save_record(record)
+        except:
+            pass
+    return record
+
+# -- Load PE samples from pelican, as an EventRecord
+# -- Only the in-memory tier is kept here; release files, extracted samples
+# -- and records are persisted on disk by the download cache, the sample
+# -- store and eventrecord.  The record is a shared resource, not a copy per
+# -- session: its arrays are read-only, memory mapped from the stored record
+# -- when there is one, so processes on the same node share them as well.
+@st.cache_resource(max_entries=20, show_spinner=False)
+def load_samples_pelican(event, gwtc=True, _progress=None):
+    with metrics.span('load_samples_pelican'):
+        record = eventrecord.load_record(event)
+        if record is None:
+            fn = fetch_samples_file(event, progress=_progress)
+            record = read_samples_file(event, fn)
+            record = eventrecord.load_record(event) or record.freeze()
+    return record
+
+# -- Shared EventRecords for a list of events, loaded by make_datadict
+def get_datadict(events):
+    return {ev: load_samples_pelican(ev) for ev in events}
 
 def stockcache(eventlist):
+    from prefetch import prefetch
     total = len(eventlist)
-    st.write("## Intializing  cache.  This may take several hours")
+    st.write("## Intializing  cache.")
+    st.write("For a faster, unattended build run `python prefetch.py` on the server.")
     cachebar = st.progress(0.01)
-    for count, ev in enumerate(eventlist):
-        cachebar.progress(count/total)
-        with st.spinner(text="Downloading data for {0} ({1} / {2})".format(ev, count, total)):
-            try:
-                load_samples_pelican(ev)
-            except:
-                continue
+    def update(count, ev, error):
+        cachebar.progress(count/total, text="{0} ({1} / {2})".format(ev, count, total))
+    with st.spinner(text="Downloading data for {0} events ...".format(total)):
+        report = prefetch(eventlist, progress=update)
+    st.write(report.summary())
 
 ALL_PARAM = ['a_1', 'a_2', 'chi_eff', 'chi_p', 'chirp_mass',
           'chirp_mass_source', 'comoving_distance', 'cos_iota',
@@ -161,37 +338,19 @@ ALL_PARAM = ['a_1', 'a_2', 'chi_eff', 'chi_p', 'chirp_mass',
           'total_mass_source']
 
 
-# -- Load strain data
-@st.cache_data(max_entries=6)   #-- Magic command to cache data
-def load_strain(t0, detector):
-    straindata = TimeSeries.fetch_open_data(detector, t0-14, t0+14, cache=False)
-    return straindata
+# -- GPS time and detectors of an event, from the catalog
+def get_event_gps(event):
+    return get_event_info(event)['gps']
 
+def get_event_detectors(event):
+    return get_event_info(event)['detectors']
 
 # -- Find URL of the PE set
-@st.cache_data(max_entries=200)
 def get_pe_url(event):
-    url = 'https://gwosc.org/eventapi/json/GWTC/'
-    gwtc = requests.get(url).json()
-    
-    for event_id, info in gwtc['events'].items():
-        if info['commonName'] == event:
-            # -- Grab single event JSON
-            evurl = info['jsonurl']
-            eventinfo = requests.get(evurl).json()
-
-            # -- Find PE data URL for GWTC-1 events
-            meta = eventinfo['events'][event_id]
-            if meta['catalog.shortName'] == 'GWTC-1-confident':
-                for peset, peinfo in meta['parameters'].items():
-                    if 'R2_pe_combined' in peset:
-                        return peinfo['data_url'], peinfo['waveform_family'], meta['catalog.shortName']
-
-
-            # -- Find PE data URL for all other events
-            for peset, peinfo in eventinfo['events'][event_id]['parameters'].items():
-                if peinfo['is_preferred'] and (peinfo['pipeline_type'] == 'pe'):
-                    return peinfo['data_url'], peinfo['waveform_family'], meta['catalog.shortName']
+    info = get_event_info(event)
+    if info is None:
+        return None
+    return info['data_url'], info['waveform_family'], info['catalog']
 
 
 # -- Set the default event choice index to any events in the GET request
@@ -0,0 +1,162 @@
+"""
+Download and extract PE samples for every GWTC event, so the app starts
+from a warm cache.
+
+    python prefetch.py                       # all GWTC catalogs
+    python prefetch.py --catalog GWTC-4.1    # a single catalog
+    python prefetch.py GW150914 GW170817     # selected events
+"""
+import argparse, os, random, threading, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+import download
+import eventrecord
+import peutils
+import samplestore
+import summarytable
+
+CATALOGS = ['GWTC-4.1', 'GWTC-3-confident', 'GWTC-2.1-confident', 'GWTC-1-confident']
+
+
+class PrefetchReport:
+    def __init__(self):
+        self.done = []
+        self.skipped = []
+        self.failed = {}
+        self.nbytes = 0
+        self.start = time.time()
+        self.elapsed = 0.0
+
+    def summary(self):
+        rate = self.nbytes / self.elapsed / 1e6 if self.elapsed else 0.0
+        lines = ['Fetched {0} events, skipped {1} cached, {2} failed'.format(
+                     len(self.done), len(self.skipped), len(self.failed)),
+                 'Downloaded {0:.1f} MB in {1:.0f} s ({2:.1f} MB/s)'.format(
+                     self.nbytes/1e6, self.elapsed, rate)]
+        for ev, err in sorted(self.failed.items()):
+            lines.append('  FAILED {0}: {1}'.format(ev, err))
+        return '\n'.join(lines)
+
+
+class HostLimiter:
+    """
+    Cap the number of simultaneous downloads from any one host
+    """
+    def __init__(self, per_host):
+        self.per_host = per_host
+        self.lock = threading.Lock()
+        self.semaphores = {}
+
+    def __call__(self, url):
+        host = urlparse(url).netloc or urlparse(url).scheme
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(self.per_host)
+            return self.semaphores[host]
+
+
+# -- Errors worth another attempt: network and disk errors (requests
+# -- exceptions are OSErrors), and truncated or corrupted downloads.  Anything
+# -- else, such as an unknown event, fails the event straight away.
+TRANSIENT = (OSError, download.DownloadError)
+
+def retry(func, attempts=3, backoff=2.0):
+    # -- Call func, sleeping backoff**n seconds (with jitter) between transient failures
+    for n in range(attempts):
+        try:
+            return func()
+        except TRANSIENT:
+            if n == attempts - 1: raise
+            time.sleep(backoff ** (n + 1) * (0.5 + random.random()))
+
+
+def fetch_event(event, limiter, attempts=3, force=False):
+    # -- Returns the number of bytes downloaded
+    url, getter = retry(lambda: peutils.get_samples_source(event), attempts=attempts)
+    fetched = download.cached_path(url) is None
+
+    def get_file():
+        with limiter(url):
+            return peutils.fetch_samples_file(event)
+
+    fn = retry(get_file, attempts=attempts)
+    peutils.read_samples_file(event, fn, overwrite=force)
+    if not samplestore.has_event(event):
+        raise RuntimeError('samples were not written to the store')
+    if not eventrecord.has_record(event):
+        raise RuntimeError('event record was not written')
+    return os.path.getsize(fn) if fetched else 0
+
+
+def prefetch(eventlist, workers=4, per_host=2, attempts=3, force=False, progress=None):
+    """
+    Fetch and extract each event in eventlist with a pool of worker threads.
+    progress, if given, is called from the calling thread as
+    progress(count, event, error) as each event finishes.
+    """
+    report = PrefetchReport()
+    limiter = HostLimiter(per_host)
+
+    todo = []
+    for ev in eventlist:
+        if ev is None: continue
+        if samplestore.has_event(ev) and eventrecord.has_record(ev) and not force:
+            report.skipped.append(ev)
+        else:
+            todo.append(ev)
+
+    count = len(report.skipped)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fetch_event, ev, limiter, attempts, force): ev for ev in todo}
+        for future in as_completed(futures):
+            ev = futures[future]
+            error = None
+            try:
+                report.nbytes += future.result()
+                report.done.append(ev)
+            except Exception as exc:
+                error = '{0}: {1}'.format(type(exc).__name__, exc)
+                report.failed[ev] = error
+            count += 1
+            if progress is not None:
+                progress(count, ev, error)
+
+    # -- Refresh the catalog-wide summary table
+    if report.done or summarytable.table_mtime() is None:
+        try:
+            summarytable.build_table(peutils.ALL_PARAM)
+        except Exception as exc:
+            report.failed['summary table'] = '{0}: {1}'.format(type(exc).__name__, exc)
+
+    report.elapsed = time.time() - report.start
+    return report
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('events', nargs='*', help='events to fetch (default: all)')
+    parser.add_argument('--catalog', action='append', choices=CATALOGS,
+                        help='catalog to fetch, may be repeated (default: all)')
+    parser.add_argument('--workers', type=int, default=4, help='number of worker threads')
+    parser.add_argument('--per-host', type=int, default=2, help='simultaneous downloads per host')
+    parser.add_argument('--retries', type=int, default=3, help='attempts per download')
+    parser.add_argument('--force', action='store_true', help='refetch events already in the store')
+    opts = parser.parse_args(args)
+
+    eventlist = opts.events or peutils.get_eventlist(catalog=opts.catalog or CATALOGS)
+    total = len(eventlist)
+
+    def update(count, ev, error):
+        status = 'FAILED' if error else 'ok'
+        print('[{0}/{1}] {2} {3}'.format(count, total, ev, status), flush=True)
+
+    report = prefetch(eventlist, workers=opts.workers, per_host=opts.per_host,
+                      attempts=opts.retries, force=opts.force, progress=update)
+    print(report.summary())
+    return 1 if report.failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,175 @@
+"""
+Figure rendering in a pool of worker processes.
+
+pesummary and ligo.skymap draw with pyplot, whose global figure registry
+is not thread safe, so the app used to hold a lock around every plot and
+concurrent users waited for each other.  Here each plot is drawn in a
+worker process, which only ever draws one figure at a time, and comes
+back as PNG bytes for st.image.  The pool has one worker per available
+core (respecting cgroup CPU limits), so plots from different sessions
+run in parallel.
+
+    PEVIEWER_RENDER_WORKERS   number of worker processes (default: cores)
+"""
+import io, os, math, threading
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+
+# -- Same resolution as st.pyplot
+DPI = 200
+
+
+def available_cpus():
+    # -- Cores this process may use, including any container CPU quota
+    if os.environ.get('PEVIEWER_RENDER_WORKERS'):
+        return max(1, int(os.environ['PEVIEWER_RENDER_WORKERS']))
+    try:
+        ncpu = len(os.sched_getaffinity(0))
+    except AttributeError:
+        ncpu = os.cpu_count() or 1
+
+    quota = None
+    try:
+        #-- cgroup v2
+        with open('/sys/fs/cgroup/cpu.max') as filein:
+            limit, period = filein.read().split()
+        if limit != 'max':
+            quota = int(limit) / int(period)
+    except (OSError, ValueError):
+        try:
+            #-- cgroup v1
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as filein:
+                limit = int(filein.read())
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as filein:
+                period = int(filein.read())
+            if limit > 0:
+                quota = limit / period
+        except (OSError, ValueError):
+            pass
+
+    if quota is not None:
+        ncpu = min(ncpu, math.ceil(quota))
+    return max(1, ncpu)
+
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use('Agg')
+    matplotlib.rcParams['text.usetex'] = False
+
+
+def _png(fig):
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', dpi=DPI, bbox_inches='tight')
+    # -- pesummary registers its figures with pyplot, so release them
+    from matplotlib import pyplot
+    pyplot.close(fig)
+    return buffer.getvalue()
+
+
+def _render(func, args, kwargs):
+    fig = func(*args, **kwargs)
+    if isinstance(fig, (tuple, list)):
+        fig = fig[0]
+    return _png(fig)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # -- spawn, since forking the threaded Streamlit server is unsafe
+            _pool = ProcessPoolExecutor(max_workers=available_cpus(),
+                                        mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=_init_worker)
+        return _pool
+
+
+def _reset_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def render(func, *args, **kwargs):
+    """
+    Draw func(*args, **kwargs), which returns a matplotlib Figure (or a
+    tuple starting with one), in a worker process and return PNG bytes.
+    func and its arguments must be picklable.
+    """
+    pool = get_pool()
+    with metrics.span('render_' + func.__name__):
+        try:
+            return pool.submit(_render, func, args, kwargs).result()
+        except BrokenProcessPool:
+            #-- e.g. a worker was killed; start a new pool next time
+            _reset_pool(pool)
+            return get_pool().submit(_render, func, args, kwargs).result()
+
+
+def sample_columns(samples_dict, params):
+    # -- Plain arrays of params for each analysis, cheap to send to a worker
+    return {label: {param: np.asarray(samples_dict[label][param], dtype=np.float64)
+                    for param in params}
+            for label in samples_dict.keys()}
+
+
+# --
+# Plot functions, run in the worker processes
+# --
+
+def triangle_plot(columns, params):
+    from pesummary.utils.samples_dict import MultiAnalysisSamplesDict
+    from kde import triangle_kwargs
+    samples = MultiAnalysisSamplesDict(columns)
+    return samples.plot(params, type='reverse_triangle', module='core',
+                        **triangle_kwargs(params))
+
+
+def hist_plot(columns, param, method='Reflection', xlow=None, xhigh=None):
+    from pesummary.utils.samples_dict import MultiAnalysisSamplesDict
+    from kde import bounded_1d_kde
+    samples = MultiAnalysisSamplesDict(columns)
+    try:
+        return samples.plot(param, type='hist', kde=True,
+                            kde_kwargs={'kde_kernel': bounded_1d_kde, 'method': method,
+                                        'xlow': xlow, 'xhigh': xhigh})
+    except:
+        return samples.plot(param, type='hist', kde=True)
+
+
+def skymap_plot(key):
+    """
+    A stored skymap (see skymapstore) with its credible regions, drawn as
+    pesummary does for the skymaps in the PE data releases
+    """
+    from ligo.skymap import plot
+    from matplotlib.figure import Figure
+    import skymapstore
+
+    prob, cls, meta = skymapstore.read_skymap(key)
+    deg2perpix = 4 * 180**2 / np.pi / len(prob)
+
+    fig = Figure()
+    ax = fig.add_subplot(111, projection='astro hours mollweide')
+    ax.grid(visible=True)
+    probperdeg2 = prob / deg2perpix
+    ax.imshow_hpx((probperdeg2, 'ICRS'), nested=meta['nest'], vmin=0.,
+                  vmax=probperdeg2.max(), cmap='cylon')
+    cs = ax.contour_hpx((cls, 'ICRS'), nested=meta['nest'], colors='k',
+                        linewidths=0.5, levels=meta['contours'])
+    ax.clabel(cs, fmt='%g%%', fontsize=6, inline=True)
+    text = ['{0:d}% area: {1:d} deg²'.format(p, int(round(meta['areas'][str(p)])))
+            for p in meta['contours']]
+    ax.text(1, 1.05, '\n'.join(text), transform=ax.transAxes, ha='right', fontsize=10)
+    plot.outline_text(ax)
+    return fig
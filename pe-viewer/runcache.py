@@ -1,11 +1,5 @@
-from selenium import webdriver
-import time
+#-- Warm the sample cache without a browser session.
+#-- Kept for existing cron jobs; see prefetch.py for options.
+from prefetch import main
 
-url = 'http://localhost:8500?buildcache=true'
-
-options = webdriver.ChromeOptions()
-options.add_argument('--headless')
-browser = webdriver.Chrome(options=options)
-page = browser.get(url)
-time.sleep(60*30)  #-- Let it run for 30 minutes
-browser.quit()
+raise SystemExit(main())
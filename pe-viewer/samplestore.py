@@ -0,0 +1,161 @@
+import os, json, shutil, tempfile
+import numpy as np
+
+from cachebackend import FileBackend, get_backend
+from cachemanager import get_manager, register, path_size
+
+# -- Extracted posterior samples are stored here, one directory per event,
+# -- with one .npy file per parameter and a small meta.json
+STOREDIR = os.environ.get('PEVIEWER_STOREDIR',
+                          os.path.join(os.path.expanduser('~'), '.peviewer', 'samples'))
+
+STORE_VERSION = 1
+
+
+def _backend(storedir=None):
+    if storedir is not None:
+        return FileBackend(storedir)
+    return get_backend('samples', STOREDIR)
+
+
+# -- Let the cache manager evict entries to stay within its byte budget
+register('samples', lambda event: _backend().drop_local(event))
+
+
+def event_dir(event, storedir=None):
+    return _backend(storedir).local_path(event)
+
+
+def has_event(event, storedir=None):
+    return _backend(storedir).get(event + '/meta.json') is not None
+
+
+def read_meta(event, storedir=None):
+    with open(_backend(storedir).get(event + '/meta.json')) as filein:
+        return json.load(filein)
+
+
+def lock(event, storedir=None):
+    # -- Context manager, so only one writer fills an event
+    return _backend(storedir).lock(event)
+
+
+def write_event(event, samples, meta=None, storedir=None, extras=None):
+    """
+    Write a single analysis (a pesummary SamplesDict or a dict of arrays)
+    to the store.  extras maps file names to dictionaries of arrays which
+    are saved alongside, as .npz files.  The directory is assembled under a
+    temporary name and renamed into place, so readers never see a partial
+    entry.
+    """
+    backend = _backend(storedir)
+    os.makedirs(backend.root, exist_ok=True)
+    tmpdir = tempfile.mkdtemp(dir=backend.root, prefix='.' + event + '-')
+    os.chmod(tmpdir, 0o755)
+
+    try:
+        parameters = []
+        for param in samples.keys():
+            values = np.asarray(samples[param], dtype=np.float64)
+            np.save(os.path.join(tmpdir, param + '.npy'), values)
+            parameters.append(param)
+
+        extras = extras or {}
+        for fn, arrays in extras.items():
+            np.savez(os.path.join(tmpdir, fn), **arrays)
+
+        meta = dict(meta or {})
+        meta.update({'event': event,
+                     'parameters': parameters,
+                     'nsamples': len(values) if parameters else 0,
+                     'version': STORE_VERSION})
+        with open(os.path.join(tmpdir, 'meta.json'), 'w') as fileout:
+            json.dump(meta, fileout)
+
+        # -- Replace any older copy of this event
+        finaldir = backend.local_path(event)
+        if os.path.exists(finaldir):
+            shutil.rmtree(finaldir, ignore_errors=True)
+        try:
+            os.replace(tmpdir, finaldir)
+        except OSError:
+            # -- Another writer filled this entry first
+            if not has_event(event, storedir): raise
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            return read_meta(event, storedir)
+    except:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        raise
+
+    # -- Publish to the backend, with meta.json last so it marks a complete entry
+    for fn in [param + '.npy' for param in parameters] + list(extras) + ['meta.json']:
+        key = event + '/' + fn
+        backend.put(key, backend.local_path(key))
+
+    if storedir is None:
+        get_manager().add('samples', event, path_size(finaldir))
+    return meta
+
+
+def write_extra(event, fn, arrays, storedir=None):
+    # -- Add a .npz file of arrays to an existing entry
+    backend = _backend(storedir)
+    fd, tmpname = tempfile.mkstemp(dir=backend.local_path(event), suffix='.npz')
+    with os.fdopen(fd, 'wb') as fileout:
+        np.savez(fileout, **arrays)
+    backend.put(event + '/' + fn, tmpname, move=True)
+
+
+def read_extra(event, fn, storedir=None):
+    # -- Dictionary of arrays from a .npz file in an entry, or None
+    path = _backend(storedir).get(event + '/' + fn)
+    if path is None:
+        return None
+    with np.load(path) as npz:
+        return {key: npz[key] for key in npz.files}
+
+
+def record_access(event):
+    # -- Count a lookup of event in the cache accounting; returns True on a hit
+    if has_event(event):
+        get_manager().hit('samples', event, event_dir(event))
+        return True
+    get_manager().miss('samples', event)
+    return False
+
+
+def list_events(storedir=None):
+    # -- Complete entries in the backend, which may not all be on local disk
+    return sorted(key[:-len('/meta.json')] for key in _backend(storedir).list()
+                  if key.count('/') == 1 and key.endswith('/meta.json'))
+
+
+class Columns(dict):
+    """
+    Dictionary of parameter -> array, with the parameters attribute of a
+    pesummary SamplesDict
+    """
+    @property
+    def parameters(self):
+        return list(self.keys())
+
+
+def read_columns(event, params=None, storedir=None, mmap=True):
+    """
+    Return a Columns dictionary of parameter -> array for the requested
+    parameters.  Parameters missing from the store are skipped.  Arrays are
+    memory mapped read-only unless mmap is False.
+    """
+    meta = read_meta(event, storedir)
+    if params is None:
+        params = meta['parameters']
+
+    backend = _backend(storedir)
+    mode = 'r' if mmap else None
+    columns = Columns()
+    for param in params:
+        if param not in meta['parameters']: continue
+        fn = backend.get(event + '/' + param + '.npy')
+        columns[param] = np.load(fn, mmap_mode=mode)
+    return columns
+
@@ -0,0 +1,138 @@
+import os, json, re, tempfile
+import numpy as np
+
+from cachebackend import get_backend
+from cachemanager import get_manager, register
+import download
+
+# -- Skymaps are stored here as nested HEALPix arrays (.npz), each with a
+# -- small .json file holding the credible areas and where the map came from
+SKYMAPDIR = os.environ.get('PEVIEWER_SKYMAPDIR',
+                           os.path.join(os.path.expanduser('~'), '.peviewer', 'skymaps'))
+
+# -- Credible regions (%) drawn and annotated on every skymap
+CONTOURS = [50, 90]
+
+# -- Maps finer than this are stored downsampled; plots are projected onto
+# -- an image far coarser than this anyway.  Areas use the full resolution.
+MAX_NSIDE = 256
+
+
+def _backend():
+    return get_backend('skymaps', SKYMAPDIR)
+
+
+def _drop(key):
+    for ext in ['.json', '.npz']:
+        _backend().drop_local(key + ext)
+
+# -- Let the cache manager evict entries to stay within its byte budget
+register('skymaps', _drop)
+
+
+def _safe(name):
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', str(name))
+
+
+def skymap_key(event, analysis):
+    return '{0}/{1}'.format(_safe(event), _safe(analysis))
+
+
+def credible_levels(prob):
+    # -- Greedy credible level (%) of every pixel
+    from ligo.skymap.postprocess import find_greedy_credible_levels
+    return 100 * find_greedy_credible_levels(prob)
+
+
+def credible_areas(cls, nside, contours=CONTOURS):
+    # -- Area (deg2) of each credible region, as annotated by pesummary
+    import healpy as hp
+    deg2perpix = hp.nside2pixarea(nside, degrees=True)
+    return {str(p): float(np.searchsorted(np.sort(cls), p) * deg2perpix) for p in contours}
+
+
+def save_skymap(key, prob, source=None):
+    """
+    Store a nested HEALPix probability map with its credible levels and areas
+    """
+    import healpy as hp
+    prob = np.asarray(prob, dtype=np.float64)
+    nside = hp.npix2nside(len(prob))
+    cls = credible_levels(prob)
+    areas = credible_areas(cls, nside)
+    if nside > MAX_NSIDE:
+        prob = hp.ud_grade(prob, MAX_NSIDE, order_in='NESTED', order_out='NESTED', power=-2)
+        nside = MAX_NSIDE
+        cls = credible_levels(prob)
+
+    backend = _backend()
+    path = backend.local_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.npz')
+    with os.fdopen(fd, 'wb') as fileout:
+        np.savez(fileout, prob=prob, cls=cls.astype(np.float32))
+    backend.put(key + '.npz', tmpname, move=True)
+
+    # -- The .json file is written last, and marks a complete entry
+    meta = {'nside': int(nside), 'nest': True, 'contours': CONTOURS,
+            'areas': areas, 'source': source}
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.json')
+    with os.fdopen(fd, 'w') as fileout:
+        json.dump(meta, fileout)
+    backend.put(key + '.json', tmpname, move=True)
+
+    get_manager().add('skymaps', key, os.path.getsize(path + '.npz'))
+    return meta
+
+
+def read_skymap(key):
+    """
+    (prob, cls, meta) for a stored skymap, or None
+    """
+    backend = _backend()
+    metapath = backend.get(key + '.json')
+    datapath = backend.get(key + '.npz') if metapath else None
+    if datapath is None:
+        return None
+    with open(metapath) as filein:
+        meta = json.load(filein)
+    with np.load(datapath) as npz:
+        return npz['prob'], npz['cls'], meta
+
+
+def record_access(key):
+    # -- Count a lookup of key in the cache accounting; returns True on a hit
+    backend = _backend()
+    if backend.get(key + '.json') and backend.get(key + '.npz'):
+        get_manager().hit('skymaps', key, backend.local_path(key + '.npz'))
+        return True
+    get_manager().miss('skymaps', key)
+    return False
+
+
+def get_skymap(event, analysis, skymap):
+    """
+    Store the skymap for one analysis of an event, if needed, and return
+    its key.  skymap is the pesummary SkyMap (or a function returning it),
+    used only the first time.
+    """
+    key = skymap_key(event, analysis)
+    if not record_access(key):
+        if callable(skymap):
+            skymap = skymap()
+        save_skymap(key, skymap, source=analysis)
+    return key
+
+
+def get_fits_skymap(event, url):
+    """
+    Store a skymap from a FITS file, downloaded once, and return its key
+    """
+    key = skymap_key(event, 'fits')
+    if not record_access(key):
+        from ligo.skymap.io.fits import read_sky_map
+        path = download.stream_download(url, suffix='.fits.gz')
+        prob, _ = read_sky_map(path, nest=True)
+        save_skymap(key, prob, source=url)
+    return key
@@ -0,0 +1,137 @@
+import os, json, re, tempfile
+import numpy as np
+
+from gwpy.timeseries import TimeSeries
+
+from cachebackend import get_backend
+from cachemanager import get_manager, register
+import whitening
+import metrics
+
+# -- Strain and whitened strain are stored here as .npy arrays, each with a
+# -- small .json file holding the start time and sample spacing
+STRAINDIR = os.environ.get('PEVIEWER_STRAINDIR',
+                           os.path.join(os.path.expanduser('~'), '.peviewer', 'strain'))
+
+
+# -- Length (s) of the whitening filter; 0.5*WHITEN_FDURATION at each end
+# -- of a whitened series is corrupted by filter settle-in
+WHITEN_FDURATION = 2
+
+
+def _backend():
+    return get_backend('strain', STRAINDIR)
+
+
+def _drop(key):
+    for ext in ['.json', '.npy']:
+        _backend().drop_local(key + ext)
+
+# -- Let the cache manager evict entries to stay within its byte budget
+register('strain', _drop)
+
+
+def _safe(name):
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', str(name))
+
+
+def strain_key(event, ifo, span, sample_rate):
+    return 'raw/{0}/{1}-{2}s-{3}Hz'.format(_safe(event), ifo, span, sample_rate)
+
+
+def whitened_key(event, ifo, span, sample_rate, psdkey):
+    return 'whitened/{0}/{1}-{2}s-{3}Hz-{4}'.format(_safe(event), ifo, span,
+                                                    sample_rate, _safe(psdkey))
+
+
+def save_series(key, series):
+    backend = _backend()
+    path = backend.local_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.npy')
+    with os.fdopen(fd, 'wb') as fileout:
+        np.save(fileout, np.asarray(series.value))
+    backend.put(key + '.npy', tmpname, move=True)
+
+    # -- The .json file is written last, and marks a complete entry
+    meta = {'t0': series.t0.value, 'dt': series.dt.value, 'name': series.name}
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.json')
+    with os.fdopen(fd, 'w') as fileout:
+        json.dump(meta, fileout)
+    backend.put(key + '.json', tmpname, move=True)
+
+    get_manager().add('strain', key, os.path.getsize(path + '.npy'))
+
+
+@metrics.timed('load_strain')
+def load_series(key):
+    # -- Returns a TimeSeries backed by a read-only memory map, or None
+    backend = _backend()
+    metapath = backend.get(key + '.json')
+    datapath = backend.get(key + '.npy') if metapath else None
+    if datapath is None:
+        get_manager().miss('strain', key)
+        return None
+
+    with open(metapath) as filein:
+        meta = json.load(filein)
+    get_manager().hit('strain', key, datapath)
+    values = np.load(datapath, mmap_mode='r')
+    return TimeSeries(values, t0=meta['t0'], dt=meta['dt'], name=meta['name'], copy=False)
+
+
+@metrics.timed('fetch_strain')
+def fetch_strain(event, ifo, t0, span=28, sample_rate=4096):
+    """
+    Strain data for span seconds centred on t0, from the disk cache or GWOSC
+    """
+    key = strain_key(event, ifo, span, sample_rate)
+    strain = load_series(key)
+    if strain is None:
+        with metrics.span('download_strain'):
+            strain = TimeSeries.fetch_open_data(ifo, t0-span/2, t0+span/2,
+                                                sample_rate=sample_rate, cache=False)
+        save_series(key, strain)
+    return strain
+
+
+def whiten_event(event, ifos, t0, psdkey, psds, templates=None, span=28,
+                 sample_rate=4096, timings=None):
+    """
+    Strain for each of ifos whitened with the PE PSD for analysis psdkey,
+    and the templates (a dictionary of TimeSeries by ifo) whitened with the
+    same filters.  Whitened strain comes from the derived products cache
+    where possible; everything else is whitened together in one batch.
+    psds maps each ifo to its PSD, and timings, if given, collects the time
+    spent in each stage.  Returns two dictionaries, data and templates.
+    """
+    timings = {} if timings is None else timings
+    templates = templates or {}
+    white_data = {}
+    with whitening.timed(timings, 'load strain'):
+        for ifo in ifos:
+            white_data[ifo] = load_series(whitened_key(event, ifo, span, sample_rate, psdkey))
+        missing = [ifo for ifo in ifos if white_data[ifo] is None]
+        strain = {ifo: fetch_strain(event, ifo, t0, span, sample_rate) for ifo in missing}
+
+    if not missing and not templates:
+        return white_data, {}
+
+    with whitening.timed(timings, 'design filters'):
+        reference = strain[missing[0]] if missing else white_data[ifos[0]]
+        duration = len(reference) * reference.dt.value
+        asds = whitening.asd_on_grid([psds[ifo] for ifo in ifos], sample_rate, duration)
+        filters = whitening.design_filters(asds, int(WHITEN_FDURATION * sample_rate))
+        row = {ifo: i for i, ifo in enumerate(ifos)}
+
+    with whitening.timed(timings, 'whiten'):
+        series = [strain[ifo] for ifo in missing] + list(templates.values())
+        order = missing + list(templates)
+        white = whitening.whiten(series, filters[[row[ifo] for ifo in order]])
+
+    with whitening.timed(timings, 'save'):
+        for ifo, ts in zip(missing, white):
+            save_series(whitened_key(event, ifo, span, sample_rate, psdkey), ts)
+            white_data[ifo] = ts
+    return white_data, dict(zip(templates, white[len(missing):]))
@@ -1,22 +1,26 @@
+import os
+
+# -- Use the non-interactive Agg backend, which is recommended as a
+# -- thread-safe backend, whenever matplotlib is first imported.
+# -- See https://matplotlib.org/3.3.2/faq/howto_faq.html#working-with-threads.
+os.environ.setdefault('MPLBACKEND', 'agg')
+
 import streamlit as st
-import pesummary
-from pesummary.io import read
-from pesummary.utils.bounded_2d_kde import Bounded_2d_kde
-from pesummary.utils.bounded_1d_kde import bounded_1d_kde
-from pesummary.gw.plots.bounds import default_bounds
-from pesummary.gw.plots.bounds import default_bounds
-from peutils import *
-from makewaveform import make_waveform, simple_make_waveform
-from makealtair import make_altair_plots, get_params_intersect
-from makeskymap import make_skymap
+from peutils import (get_eventlist, get_getparams, check_buildcache, make_datadict,
+                     get_datadict, format_data, get_pe_url, stockcache)
 from copy import deepcopy
-import glob, os
+import samplestore
+from cachemanager import get_manager, format_bytes
+
+import render
+import figurecache
+import metrics
 
-import matplotlib
-matplotlib.use('Agg')
+# -- The modules for each section, which load pesummary, gwpy, altair and
+# -- ligo.skymap, are imported only when that section is shown
 
-import threading
-lock = threading.RLock()
+# -- Prometheus endpoint for this process, started on the first run
+metrics.start()
 
 st.set_page_config(layout="centered",
                    page_title="GW Event Viewer",
@@ -44,30 +48,34 @@ eventlist2.insert(0,None)
 startindex1, startindex2, startindex3 = get_getparams(eventlist,eventlist2)
 dummy = check_buildcache(eventlist)
 
-# -- Helper method to get list of events
+# -- Helper method to get list of events, skipping any which failed to load
 def get_event_list():
     x = [st.session_state['ev1'], 
         st.session_state['ev2'],
         st.session_state['ev3']]
-    chosenlist = list(filter(lambda a: a != None, x))
+    failed = st.session_state.get('failed', {})
+    chosenlist = list(filter(lambda a: a != None and a not in failed, x))
     return chosenlist
 
 #-- Define method for updating PE, to be called when chosen event changes
 def update_pe():
+    st.session_state['failed'] = {}
     chosenlist = get_event_list()
     # -- Load all PE samples into datadict 
     with st.spinner(text="Loading data ..."):
         try:
-            st.session_state['datadict'] = make_datadict(chosenlist)
+            datadict, failed = make_datadict(chosenlist)
         except:
+            datadict, failed = {}, {ev: 'unknown error' for ev in chosenlist}
+        st.session_state['failed'] = failed
+        if not datadict:
             st.markdown("Events: {0}".format(chosenlist))
             if st.button("Reload page"):
                 st.rerun()
             st.error("Failed to load posterior samples for these events. Try reloading the app, and report an issue if needed.")
             st.stop()
-    # -- Load the published PE samples into a pesummary object
-    with st.spinner(text="Formatting data ..."):
-        st.session_state['published_dict'] = format_data(chosenlist, st.session_state['datadict'])  
+        # -- The samples are shared by all sessions; only the names are kept here
+        st.session_state['loaded'] = list(datadict)
 
 # -- Create form to set event data selection
 with st.sidebar:
@@ -81,19 +89,18 @@ with st.sidebar:
 chosenlist = get_event_list()
 
 # --
-# Display page tab structure
+# Display page section structure
 # --
-about, skymap, onedim, waveform, twodim, config  = st.tabs([
-    'About',
-    'Skymaps',
-    'All Parameters',
-    'Waveform',
-    'Select Parameters',
-    'Config'
-])
+# -- Only the selected section is run, so e.g. the parameter plots are
+# -- not computed while looking at skymaps (st.tabs would run them all)
+SECTIONS = ['About', 'Skymaps', 'All Parameters', 'Waveform', 'Select Parameters', 'Catalog', 'Config']
+section = st.segmented_control('Section', SECTIONS, default='About', key='section',
+                               label_visibility='collapsed')
+if section is None:
+    section = 'About'
 
 # -- Display ABOUT information before the data is loaded
-with about:
+if section == 'About':
     with st.expander("Watch video introduction"):
         st.video('https://youtu.be/74SxD0T92Oo')
     with open('README.md', 'r') as filein:
@@ -102,33 +109,62 @@ with about:
 
 
 # -- Initialize session state (e.g. download GW150914 data)
-if 'datadict' not in st.session_state:
+if 'loaded' not in st.session_state:
     update_pe()
+    chosenlist = get_event_list()
+
+# -- Note any events which could not be loaded
+for ev, err in st.session_state.get('failed', {}).items():
+    st.sidebar.warning("Failed to load posterior samples for {0}; showing the other events.".format(ev))
 
 
 # -- Add share info
-with about:
+if section == 'About':
     st.markdown("## Share this page")
     st.markdown(":link: [Link to share these plots](/?event1={0}&event2={1}&event3={2})".format(ev1, ev2, ev3)) 
 
 # ------------------------
 # -- Dispaly config options
 # -----------------------
-with config:
+if section == 'Config':
 
     # -- Check cache status
-    homedir = os.path.expanduser('~')
-    cachelist = glob.glob(homedir + '/.streamlit/cache/*.memo')
-    cachesize = len(cachelist)
-    cachepercent = int(cachesize / len(eventlist) * 100)
-    st.metric('Cache Size:', '{0}%'.format(cachepercent))
+    stats = get_manager().stats()
+    cached = set(samplestore.list_events()).intersection(eventlist)
+    col1, col2, col3 = st.columns(3)
+    if get_manager().shared:
+        col1.metric('Disk usage:', 'shared',
+                    help='The cache is on a shared filesystem, which this replica does not evict from')
+    else:
+        col1.metric('Disk usage:', format_bytes(stats['bytes']),
+                    help='Budget: {0}'.format(format_bytes(stats['budget'])))
+    col2.metric('Hit ratio:', '{0:.0%}'.format(stats['hit_rate']),
+                help='{0} hits, {1} misses'.format(stats['hits'], stats['misses']))
+    col3.metric('Events cached:', '{0} / {1}'.format(len(cached), len(eventlist)))
+
+    import pandas as pd
+    with st.expander('Cache entries'):
+        st.dataframe(pd.DataFrame(get_manager().entries()), hide_index=True)
+
+    # -- Where this session's time went, and the totals for this server process
+    if st.toggle('Show timings', key='debug_timings'):
+        spans = pd.DataFrame(metrics.session_spans(),
+                             columns=['time', 'stage', 'seconds', 'error'])
+        spans['time'] = pd.to_datetime(spans['time'], unit='s')
+        st.markdown("#### This session")
+        st.dataframe(spans.iloc[::-1], hide_index=True)
+        st.markdown("#### All sessions on this server")
+        st.dataframe(pd.DataFrame(metrics.stage_summary()), hide_index=True)
+        st.caption('Also served in the Prometheus format on port {0}, at /metrics.'.format(
+            metrics.METRICS_PORT))
 
     st.write("## Build Cache")
     st.write("""This app uses a local cache to store data downloaded from zenodo.  The cache is designed to 
-            build up over time as the app is used, or the cache may be built on-demand.  This process could take
-            up to several hours, but may improve app performance after it is complete.""")
+            build up over time as the app is used, or the cache may be built on-demand.  Building the whole
+            cache from here can take a long time; on the server, `python prefetch.py` does the same work
+            in parallel without a browser session.""")
 
-    if cachepercent < 99:
+    if len(cached) < len(eventlist):
         st.button('Build Cache', on_click=stockcache, args=[eventlist], type='primary')
     else:
         st.write("Cache is complete!")
@@ -142,36 +178,54 @@ with config:
         st.warning("WARNING: Clearing the cache will slow down the app for all users.", icon="⚠️")
         if st.button("Clear Cache", type='primary'):
             st.cache_data.clear()
+            get_manager().clear()
 
 
-# -- Short-cut variable names
-datadict = st.session_state['datadict']
-published_dict = st.session_state['published_dict']
+# -- Catalog-wide comparison, from the precomputed summary table only
+if section == 'Catalog':
+    from makepopulation import make_population_plots
+    make_population_plots(chosenlist)
+
+# -- Shared, read-only samples for the loaded events, fetched only for
+# -- the sections which plot them
+if section in ['Skymaps', 'All Parameters', 'Waveform', 'Select Parameters']:
+    datadict = get_datadict(st.session_state['loaded'])
+if section in ['All Parameters', 'Select Parameters']:
+    with st.spinner(text="Formatting data ..."):
+        published_dict = format_data(chosenlist, datadict)
 
 # --------------
 # Display plots
 # --------------
 
-with skymap:
+if section == 'Skymaps':
+    from makeskymap import make_skymap
     make_skymap(chosenlist, datadict)
 
-with onedim:    
+if section == 'All Parameters':
+    from makealtair import make_altair_plots
     make_altair_plots(chosenlist, published_dict)
 
-with waveform:
+if section == 'Waveform':
     st.markdown("### Making waveform for Event 1: {0}".format(ev1))
     st.markdown("This app only creates waveforms for one event (Event 1) to reduce run time.")
+    from makewaveform import make_waveform, simple_make_waveform
     
-    try:
-        make_waveform(ev1, datadict)
-    except:
-        st.write("Unable to generate maximum likelihood waveform.  Making approximate waveform instead.")
+    if ev1 not in datadict:
+        st.write("Posterior samples for {0} could not be loaded.".format(ev1))
+    else:
         try:
-            simple_make_waveform(ev1, datadict)
+            make_waveform(ev1, datadict)
         except:
-            st.write("Unable to generate waveform")
+            st.write("Unable to generate maximum likelihood waveform.  Making approximate waveform instead.")
+            try:
+                simple_make_waveform(ev1, datadict)
+            except:
+                st.write("Unable to generate waveform")
     
-with twodim:
+if section == 'Select Parameters':
+    from makealtair import get_params_intersect
+    from pesummary.gw.plots.bounds import default_bounds
     st.markdown("""
         * These 2-D plots can reveal correlations between parameters.  
         * Select the events you'd like to see in the left sidebar, and the parameters to plot below.
@@ -205,20 +259,16 @@ with twodim:
     # -- Make plot based on selected parameters
     st.markdown("### Triangle plot")
     ch_param = [param1, param2]
-    with lock:
-        with st.spinner(text="Making triangle plot ..."):
-
-            xbounds = default_bounds[param1]
-            ybounds = default_bounds[param2]
-            fig, _, _, _ = published_dict.plot(ch_param, type="reverse_triangle", module="gw",
-                                        kde_2d=Bounded_2d_kde,
-                                        kde_k2d_kwargs={"xlow": xbounds.get("low", None),
-                                                        "xhigh": xbounds.get("high", None),
-                                                        "ylow": ybounds.get("low", None),
-                                                        "yhigh": ybounds.get("high", None)})
-            
-        #fig = published_dict.plot(ch_param, type='reverse_triangle', grid=False)    
-        st.pyplot(fig)
+    # -- Analysis used for each event, which identifies the samples
+    analyses = [get_pe_url(ev)[1] for ev in chosenlist]
+    with st.spinner(text="Making triangle plot ..."), metrics.span('triangle_plot'):
+        # -- Drawn in a worker process, with the binned KDEs from kde.py
+        key = figurecache.figure_key('triangle', chosenlist, analysis=analyses, params=ch_param,
+                                     bounds=[default_bounds.get(p, {}) for p in ch_param])
+        png = figurecache.cached_figure(
+            key, render.triangle_plot,
+            inputs=lambda: [render.sample_columns(published_dict, ch_param), ch_param])
+    st.image(png, width='stretch')
 
     # -- 1-D plots
     for param in [param1, param2]:
@@ -229,16 +279,15 @@ with twodim:
         method = "Reflection"
         if param == "chi_p":
             method = "Transform"
-            
-        with lock:
-            try:
-                fig = published_dict.plot(param, type="hist", kde=True,
-                               kde_kwargs={"kde_kernel": bounded_1d_kde, "method": method,
-                                           "xlow": bounds.get("low", None), "xhigh": bounds.get("high", None)})
-            except:
-                fig = published_dict.plot(param, type='hist', kde=True)               
-            
-            st.pyplot(fig)
+
+        key = figurecache.figure_key('hist', chosenlist, analysis=analyses, params=[param],
+                                     bounds=bounds, method=method)
+        png = figurecache.cached_figure(key, render.hist_plot,
+                                        inputs=lambda: [render.sample_columns(published_dict, [param]),
+                                                        param],
+                                        method=method, xlow=bounds.get("low", None),
+                                        xhigh=bounds.get("high", None))
+        st.image(png, width='stretch')
 
     with st.expander("See code"):
         st.write("""First, download a posterior samples file from the
@@ -0,0 +1,145 @@
+"""
+Catalog-wide summary statistics, for comparing one parameter across every
+event without reading any samples.
+
+When an event's samples enter the store, its medians, credible intervals
+and a coarse histogram of every parameter are saved alongside them
+(SUMMARY_FILE).  build_table gathers those into one table, a single .npz
+of arrays indexed [event, parameter, ...], which the Catalog section
+loads and queries with numpy.
+"""
+import os, tempfile
+import numpy as np
+
+import samplestore
+
+SUMMARY_FILE = 'summary.npz'
+
+TABLE_FILE = os.environ.get('PEVIEWER_SUMMARY_TABLE',
+                            os.path.join(os.path.dirname(samplestore.STOREDIR), 'summary-table.npz'))
+
+# -- Median and 90% credible interval
+QUANTILES = [0.05, 0.5, 0.95]
+
+# -- Bins of the per-event histograms, evenly spaced between the extreme samples
+HIST_BINS = 50
+
+
+def summarize(columns, params):
+    """
+    Quantiles, sample range and histogram of each of params in columns, as
+    arrays for np.savez; NaN for parameters which are missing
+    """
+    quantiles = np.full((len(params), len(QUANTILES)), np.nan)
+    ranges = np.full((len(params), 2), np.nan)
+    hist = np.zeros((len(params), HIST_BINS), dtype=np.float32)
+    for i, param in enumerate(params):
+        if param not in columns: continue
+        values = np.asarray(columns[param], dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if len(values) == 0: continue
+        quantiles[i] = np.quantile(values, QUANTILES)
+        ranges[i] = values.min(), values.max()
+        if ranges[i, 1] > ranges[i, 0]:
+            hist[i] = np.histogram(values, bins=HIST_BINS, range=ranges[i])[0] / len(values)
+    return {'params': np.array(params), 'quantiles': quantiles, 'range': ranges, 'hist': hist}
+
+
+def build_table(params, storedir=None, path=None):
+    """
+    Gather the summaries of every event in the sample store into one table
+    and write it to path (default TABLE_FILE).  Summaries missing from older
+    entries are computed from the stored samples, and saved.  Returns the
+    table, or None if the store is empty.
+    """
+    events, catalogs, summaries = [], [], []
+    for event in samplestore.list_events(storedir):
+        summary = samplestore.read_extra(event, SUMMARY_FILE, storedir)
+        if summary is None or list(summary['params']) != list(params):
+            summary = summarize(samplestore.read_columns(event, params, storedir), params)
+            try:
+                samplestore.write_extra(event, SUMMARY_FILE, summary, storedir)
+            except OSError:
+                pass
+        events.append(event)
+        catalogs.append(samplestore.read_meta(event, storedir).get('catalog') or '')
+        summaries.append(summary)
+
+    if not events:
+        return None
+    table = {'events': np.array(events, dtype=str), 'catalogs': np.array(catalogs, dtype=str),
+             'params': np.array(params)}
+    for key in ['quantiles', 'range', 'hist']:
+        table[key] = np.stack([summary[key] for summary in summaries])
+
+    path = path or TABLE_FILE
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.npz')
+    with os.fdopen(fd, 'wb') as fileout:
+        np.savez(fileout, **table)
+    os.replace(tmpname, path)
+    return table
+
+
+def read_table(path=None):
+    # -- The summary table as a dictionary of arrays, or None
+    path = path or TABLE_FILE
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as npz:
+        return {key: npz[key] for key in npz.files}
+
+
+def table_mtime(path=None):
+    # -- Modification time of the table, to key caches on; None if missing
+    try:
+        return os.path.getmtime(path or TABLE_FILE)
+    except OSError:
+        return None
+
+
+def select(table, param, catalogs=None):
+    # -- Row mask of events which have param, and are in catalogs unless it is None
+    j = list(table['params']).index(param)
+    mask = np.isfinite(table['quantiles'][:, j, 1])
+    if catalogs is not None:
+        mask &= np.isin(table['catalogs'], catalogs)
+    return j, mask
+
+
+def param_summary(table, param, catalogs=None):
+    """
+    DataFrame of event, catalog, median and credible interval of param,
+    for every event in the table which has it
+    """
+    import pandas as pd
+    j, mask = select(table, param, catalogs)
+    quantiles = table['quantiles'][mask, j]
+    return pd.DataFrame({'event': table['events'][mask], 'catalog': table['catalogs'][mask],
+                         'median': quantiles[:, 1], 'lower': quantiles[:, 0],
+                         'upper': quantiles[:, -1]})
+
+
+def shared_histograms(table, param, catalogs=None, nbins=100):
+    """
+    Histograms of param for the selected events, rebinned onto nbins
+    shared bins by interpolating each event's cumulative distribution.
+    Returns (edges, events, density) with density indexed [event, bin].
+    """
+    j, mask = select(table, param, catalogs)
+    hist = table['hist'][mask, j].astype(np.float64)
+    low, high = table['range'][mask, j].T
+    edges = np.linspace(np.min(low), np.max(high), nbins + 1)
+
+    # -- Position of each shared edge in units of each event's bins
+    nfine = hist.shape[1]
+    width = np.where(high > low, high - low, 1.)
+    pos = np.clip((edges[None, :] - low[:, None]) / width[:, None] * nfine, 0, nfine)
+    index = np.minimum(pos.astype(int), nfine - 1)
+    cdf = np.concatenate([np.zeros((len(hist), 1)), np.cumsum(hist, axis=1)], axis=1)
+    lower = np.take_along_axis(cdf, index, axis=1)
+    upper = np.take_along_axis(cdf, index + 1, axis=1)
+    cumulative = lower + (pos - index) * (upper - lower)
+
+    density = np.diff(cumulative, axis=1) / np.diff(edges)
+    return edges, table['events'][mask], density
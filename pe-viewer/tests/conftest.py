@@ -0,0 +1,80 @@
+"""
+Fixtures for the tests.  Every cache of the app is pointed at a temporary
+directory, and upstream servers are replaced by a local http.server.
+"""
+import os, sys, shutil, tempfile, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+_tmpdir = None
+
+
+def pytest_configure(config):
+    """
+    Point every cache at a scratch directory.  The app's modules read their
+    directories when first imported, so this runs before any test imports them.
+    """
+    global _tmpdir
+    _tmpdir = tempfile.mkdtemp(prefix='peviewer-test-')
+    for name, sub in [('DATADIR', 'data'), ('STOREDIR', 'samples'), ('RECORDDIR', 'records'),
+                      ('STRAINDIR', 'strain'), ('SKYMAPDIR', 'skymaps'), ('FIGDIR', 'figures'),
+                      ('HTTPDIR', 'http')]:
+        os.environ['PEVIEWER_' + name] = os.path.join(_tmpdir, sub)
+    os.environ['PEVIEWER_CACHE_DB'] = os.path.join(_tmpdir, 'cache.db')
+    os.environ.pop('PEVIEWER_CACHE', None)
+    sys.path.insert(0, os.path.dirname(HERE))
+
+
+def pytest_unconfigure(config):
+    if _tmpdir is not None:
+        shutil.rmtree(_tmpdir, ignore_errors=True)
+
+
+class MockServer(ThreadingHTTPServer):
+    """
+    A local server which answers each GET with the next response queued
+    for its path, and records the headers of every request
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _MockHandler)
+        self.responses = {}
+        self.requests = []
+        self.url = 'http://127.0.0.1:{0}'.format(self.server_address[1])
+
+    def queue(self, path, status=200, body=b'', headers=None, delay=0):
+        self.responses.setdefault(path, []).append((status, body, headers or {}, delay))
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers)))
+        queued = self.server.responses.get(self.path)
+        if not queued:
+            self.send_error(404)
+            return
+        status, body, headers, delay = queued.pop(0) if len(queued) > 1 else queued[0]
+        if delay:
+            threading.Event().wait(delay)
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def mock_server():
+    server = MockServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,50 @@
+"""
+Release file downloads against a local mock server: the published
+checksum is looked up, and a download which does not match it is not
+cached.
+"""
+import hashlib, json
+import pytest
+
+DATA = b'release file contents' * 1000
+
+
+@pytest.fixture
+def release(mock_server, monkeypatch):
+    # -- A release file, and a zenodo record listing its checksum
+    import peutils
+    mock_server.queue('/files/GW150914_PEDataRelease.h5', body=DATA)
+    mock_server.queue('/files/GW151226_PEDataRelease.h5', body=DATA[:-1] + b'!')
+    files = [{'key': 'GW{0}_PEDataRelease.h5'.format(name),
+              'checksum': 'md5:' + hashlib.md5(DATA).hexdigest()} for name in ['150914', '151226']]
+    mock_server.queue('/api/records/8177023', body=json.dumps({'files': files}).encode())
+
+    monkeypatch.setattr(peutils, 'ZENODO_API', mock_server.url + '/api/records/')
+    monkeypatch.setattr(peutils, 'get_pe_url', lambda event: (
+        mock_server.url + '/files/{0}_PEDataRelease.h5'.format(event),
+        'C01:IMRPhenomXPHM', 'GWTC-3-confident'))
+    return peutils
+
+
+def test_release_checksum(release):
+    assert release.get_release_checksum('GW150914') == 'md5:' + hashlib.md5(DATA).hexdigest()
+    assert release.get_release_checksum('GW170817') is None
+
+
+def test_checksum_match(release, tmp_path):
+    import download
+    url = release.get_pe_url('GW150914')[0]
+    path = download.stream_download(url, checksum=release.get_release_checksum('GW150914'),
+                                    datadir=str(tmp_path))
+    with open(path, 'rb') as filein:
+        assert filein.read() == DATA
+
+
+def test_checksum_mismatch(release, tmp_path):
+    # -- Same length, different contents: caught only by the checksum
+    import download
+    url = release.get_pe_url('GW151226')[0]
+    with pytest.raises(download.DownloadError):
+        download.stream_download(url, checksum=release.get_release_checksum('GW151226'),
+                                 datadir=str(tmp_path))
+    assert download.cached_path(url, datadir=str(tmp_path)) is None
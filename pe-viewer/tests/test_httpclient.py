@@ -0,0 +1,88 @@
+"""
+The upstream client against a local mock of GWOSC: revalidation of stored
+JSON, retries of server errors, and timeouts.  From the pe-viewer directory:
+
+    python -m pytest tests
+"""
+import importlib, json
+import pytest
+import requests
+
+CATALOG = '/eventapi/json/GWTC/'
+
+
+@pytest.fixture
+def httpclient(mock_server, monkeypatch):
+    # -- The client, reloaded to read its settings from the environment
+    monkeypatch.setenv('PEVIEWER_GWOSC_URL', mock_server.url)
+    monkeypatch.setenv('PEVIEWER_HTTP_TIMEOUT', '2,0.5')
+    monkeypatch.setenv('PEVIEWER_HTTP_RETRIES', '2')
+    import httpclient
+    return importlib.reload(httpclient)
+
+
+def body(**events):
+    return json.dumps({'events': events}).encode()
+
+
+def test_gwosc_url_from_environment(httpclient, mock_server):
+    assert httpclient.GWOSC_URL == mock_server.url
+
+
+def test_revalidate_not_modified(httpclient, mock_server):
+    # -- A stored document is revalidated, and reused on a 304
+    path = CATALOG + '?revalidate'
+    mock_server.queue(path, body=body(GW150914={}),
+                      headers={'ETag': '"v1"', 'Last-Modified': 'Mon, 14 Sep 2015 09:50:45 GMT'})
+    mock_server.queue(path, status=304)
+
+    url = httpclient.GWOSC_URL + path
+    first = httpclient.get_json(url)
+    second = httpclient.get_json(url)
+    assert first == second == {'events': {'GW150914': {}}}
+
+    headers = [headers for p, headers in mock_server.requests if p == path]
+    assert len(headers) == 2
+    assert 'If-None-Match' not in headers[0]
+    assert headers[1]['If-None-Match'] == '"v1"'
+    assert headers[1]['If-Modified-Since'] == 'Mon, 14 Sep 2015 09:50:45 GMT'
+
+
+def test_max_age_skips_request(httpclient, mock_server):
+    path = CATALOG + '?max_age'
+    mock_server.queue(path, body=body(GW150914={}))
+    url = httpclient.GWOSC_URL + path
+    httpclient.get_json(url, max_age=3600)
+    httpclient.get_json(url, max_age=3600)
+    assert len(mock_server.requests) == 1
+
+
+def test_retry_service_unavailable(httpclient, mock_server):
+    # -- A 503 is retried, honouring Retry-After
+    path = CATALOG + '?retry'
+    mock_server.queue(path, status=503, headers={'Retry-After': '0'})
+    mock_server.queue(path, body=body(GW151226={}))
+
+    assert httpclient.get_json(httpclient.GWOSC_URL + path) == {'events': {'GW151226': {}}}
+    assert len(mock_server.requests) == 2
+
+
+def test_timeout(httpclient, mock_server):
+    # -- A server slower than the read timeout fails after the retries
+    path = CATALOG + '?timeout'
+    mock_server.queue(path, body=body(GW170104={}), delay=2)
+
+    with pytest.raises(requests.RequestException):
+        httpclient.get_json(httpclient.GWOSC_URL + path)
+    assert len(mock_server.requests) == 1 + httpclient.RETRIES
+
+
+def test_timeout_uses_stored_copy(httpclient, mock_server):
+    # -- If the server stops answering, the stored copy is used
+    path = CATALOG + '?stale'
+    mock_server.queue(path, body=body(GW170104={}))
+    mock_server.queue(path, body=body(GW170817={}), delay=2)
+
+    url = httpclient.GWOSC_URL + path
+    assert httpclient.get_json(url) == {'events': {'GW170104': {}}}
+    assert httpclient.get_json(url) == {'events': {'GW170104': {}}}
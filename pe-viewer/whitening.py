@@ -0,0 +1,116 @@
+"""
+Whitening of strain data and templates with the PE PSDs, for several
+detectors at once.
+
+This follows gwpy's TimeSeries.whiten (inverse spectrum truncation: an
+FIR filter of fduration seconds designed from 1/ASD, applied by FFT
+convolution), but works on stacks of series as 2-D arrays: the filters
+for all detectors are designed in one pass, and all series of the same
+length are whitened with one batched FFT.  The data and the template for
+a detector are whitened with the same filter.
+"""
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
+import numpy as np
+from scipy.signal import fftconvolve, get_window
+from scipy.special import expit
+
+
+def psd_array(psd):
+    # -- (frequency, value) arrays from a PE PSD, e.g. pesummary's PSD or a list of pairs
+    psd = np.asarray(psd, dtype=np.float64)
+    return psd[:, 0], psd[:, 1]
+
+
+@lru_cache(maxsize=16)
+def frequency_grid(sample_rate, duration):
+    # -- rfft frequencies of duration seconds of data, shared by every detector
+    grid = np.linspace(0, sample_rate / 2, int(duration * sample_rate / 2), endpoint=False)
+    grid.flags.writeable = False
+    return grid
+
+
+def asd_on_grid(psds, sample_rate, duration):
+    """
+    ASDs for a list of PSDs, interpolated onto the frequency grid of a data
+    segment, as a 2-D array; infinite outside each PSD's frequency range
+    """
+    grid = frequency_grid(sample_rate, duration)
+    out = np.empty((len(psds), len(grid)))
+    for row, psd in zip(out, psds):
+        freq, value = psd_array(psd)
+        row[:] = np.interp(grid, freq, value, left=np.inf, right=np.inf)
+    return np.sqrt(out)
+
+
+@lru_cache(maxsize=4)
+def _planck(nsamp, ntaper=5):
+    # -- Planck taper of ntaper samples at each end, as gwpy.signal.window.planck
+    window = np.ones(nsamp)
+    k = np.arange(1, ntaper)
+    window[0] = window[-1] = 0
+    window[1:ntaper] = expit(-ntaper * (1. / k + 1. / (k - ntaper)))
+    window[nsamp - ntaper:nsamp - 1] = expit(ntaper * (1. / (k - ntaper) + 1. / k))
+    return window
+
+
+def design_filters(asds, ntaps):
+    """
+    Whitening FIR filters (one row per ASD), as gwpy's fir_from_transfer
+    """
+    transfer = np.where(np.isinf(asds), 0., 1. / asds) * _planck(asds.shape[-1])
+    impulse = np.fft.irfft(transfer, axis=-1)
+
+    trunc_start = int(ntaps / 2)
+    trunc_stop = impulse.shape[-1] - trunc_start
+    window = get_window('hann', ntaps)
+    impulse[:, 0:trunc_start] *= window[trunc_start:ntaps]
+    impulse[:, trunc_stop:] *= window[0:trunc_start]
+    impulse[:, trunc_start:trunc_stop] = 0
+    return np.roll(impulse, int(ntaps / 2 - 1), axis=-1)[:, 0:ntaps]
+
+
+def apply_filters(data, filters, dt):
+    """
+    Whiten a 2-D stack of equal-length series, row by row, with filters
+    """
+    ntaps = filters.shape[-1]
+    pad = int(np.ceil(ntaps / 2))
+    window = get_window('hann', ntaps)
+
+    data = data - data.mean(axis=-1, keepdims=True)
+    data[:, :pad] *= window[:pad]
+    data[:, -pad:] *= window[-pad:]
+    return fftconvolve(data, filters, mode='same', axes=-1) * np.sqrt(2 * dt)
+
+
+def whiten(series, filters):
+    """
+    Whiten a list of gwpy TimeSeries, series[i] with filters[i].  Series of
+    equal length are stacked and whitened together.  Returns a list of
+    TimeSeries.
+    """
+    from gwpy.timeseries import TimeSeries
+    out = [None] * len(series)
+    bylength = {}
+    for i, ts in enumerate(series):
+        bylength.setdefault(len(ts), []).append(i)
+    for index in bylength.values():
+        data = np.stack([np.asarray(series[i].value, dtype=np.float64) for i in index])
+        white = apply_filters(data, filters[index], series[index[0]].dt.value)
+        for row, i in zip(white, index):
+            out[i] = TimeSeries(row, t0=series[i].t0.value, dt=series[i].dt.value,
+                                name=series[i].name)
+    return out
+
+
+@contextmanager
+def timed(timings, stage):
+    # -- Add the wall-clock time of a block to timings[stage]
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.) + time.perf_counter() - start